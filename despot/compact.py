@@ -0,0 +1,268 @@
+from array import array
+from collections.abc import MutableMapping
+from sys import intern
+
+# compact in-memory representation of the releases dict
+# tracks and releases are __slots__ objects, tag keys and values are interned,
+# and numeric track data is stored in array-backed columns shared by the whole library
+# the conversion to and from the dict schema (see README) is lossless
+# libraries, releases, tracks and files are mutable mappings with the same keys as the dicts,
+# so the queries (find_*, report_issues, calc_stats, etc.) accept a CompactLibrary as "releases"
+# (tag values are tuples instead of lists, and the column fields can only be set to the same type)
+
+# track fields stored in columns and their array typecodes
+TRACK_COLUMNS = {
+	'mtime':	'd',
+	'length':	'd',
+	'samples':	'q',
+	'depth':	'I',
+	'rate':		'I'
+}
+# python types the column values must have to be stored in columns losslessly
+COLUMN_TYPES = { 'd': float, 'q': int, 'I': int }
+FILE_TYPES = ('tracks','images','files')
+
+def intern_tags(tags: dict[str,list]) -> dict[str,tuple]:
+	return dict(
+			(intern(key), tuple( intern(v) if isinstance(v, str) else v for v in values ))
+			for key, values in tags.items()
+	)
+
+class Track(MutableMapping):
+	__slots__ = ('columns', 'row', 'tags', 'embedded_image', 'extra')
+
+	def __init__(self, columns: 'CompactLibrary', blob: dict):
+		self.columns = columns
+		self.row = columns.add_row(blob)
+		self.embedded_image = blob['embedded_image'] if type(blob.get('embedded_image')) is bool else None
+		self.tags = intern_tags(blob['tags']) if isinstance(blob.get('tags'), dict) else None
+		# everything else (upload fields, or data that didn't fit the compact fields)
+		skip = (
+			*(TRACK_COLUMNS if self.row >= 0 else ()),
+			*(('embedded_image',) if self.embedded_image is not None else ()),
+			*(('tags',) if self.tags is not None else ())
+		)
+		self.extra = dict( (k,v) for k,v in blob.items() if k not in skip ) or None
+
+	def __getattr__(self, name: str):
+		if name in TRACK_COLUMNS:
+			if self.row >= 0:
+				return getattr(self.columns, name)[self.row]
+			if self.extra is not None and name in self.extra:
+				return self.extra[name]
+		raise AttributeError(name)
+
+	def __getitem__(self, key: str):
+		if key in TRACK_COLUMNS and self.row >= 0:
+			return getattr(self.columns, key)[self.row]
+		if key == 'embedded_image' and self.embedded_image is not None:
+			return self.embedded_image
+		if key == 'tags' and self.tags is not None:
+			return self.tags
+		if self.extra is not None and key in self.extra:
+			return self.extra[key]
+		raise KeyError(key)
+
+	def __setitem__(self, key: str, value):
+		if key in TRACK_COLUMNS and self.row >= 0:
+			if type(value) is not COLUMN_TYPES[TRACK_COLUMNS[key]]:
+				raise Exception(f'Track {key} must be {COLUMN_TYPES[TRACK_COLUMNS[key]].__name__} to be stored in the columns.')
+			getattr(self.columns, key)[self.row] = value
+		elif key == 'embedded_image' and type(value) is bool and (self.extra is None or key not in self.extra):
+			self.embedded_image = value
+		elif key == 'tags' and isinstance(value, dict) and (self.extra is None or key not in self.extra):
+			self.tags = intern_tags(value)
+		else:
+			if self.extra is None:
+				self.extra = {}
+			self.extra[key] = value
+
+	def __delitem__(self, key: str):
+		if key in TRACK_COLUMNS and self.row >= 0:
+			raise Exception(f'Track {key} is stored in the columns and can\'t be removed.')
+		if key == 'embedded_image' and self.embedded_image is not None:
+			self.embedded_image = None
+		elif key == 'tags' and self.tags is not None:
+			self.tags = None
+		elif self.extra is not None and key in self.extra:
+			del self.extra[key]
+		else:
+			raise KeyError(key)
+
+	def __iter__(self):
+		if self.row >= 0:
+			yield from ('mtime', 'depth', 'rate', 'length', 'samples')
+		if self.embedded_image is not None:
+			yield 'embedded_image'
+		if self.tags is not None:
+			yield 'tags'
+		if self.extra is not None:
+			yield from self.extra
+
+	def __len__(self) -> int:
+		return (len(TRACK_COLUMNS) if self.row >= 0 else 0) + (self.embedded_image is not None) \
+				+ (self.tags is not None) + (len(self.extra) if self.extra is not None else 0)
+
+	def to_dict(self) -> dict:
+		blob = {}
+		if self.row >= 0:
+			for column in ('mtime', 'depth', 'rate', 'length', 'samples'):
+				blob[column] = getattr(self.columns, column)[self.row]
+		if self.embedded_image is not None:
+			blob['embedded_image'] = self.embedded_image
+		if self.tags is not None:
+			blob['tags'] = dict( (k, list(v)) for k,v in self.tags.items() )
+		if self.extra is not None:
+			blob.update(self.extra)
+		return blob
+
+class File(MutableMapping):
+	__slots__ = ('mtime', 'extra')
+
+	def __init__(self, blob: dict):
+		self.mtime = blob['mtime'] if type(blob.get('mtime')) is float else None
+		self.extra = dict( (k,v) for k,v in blob.items() if k != 'mtime' or self.mtime is None ) or None
+
+	def __getitem__(self, key: str):
+		if key == 'mtime' and self.mtime is not None:
+			return self.mtime
+		if self.extra is not None and key in self.extra:
+			return self.extra[key]
+		raise KeyError(key)
+
+	def __setitem__(self, key: str, value):
+		if key == 'mtime' and type(value) is float and (self.extra is None or key not in self.extra):
+			self.mtime = value
+		else:
+			if self.extra is None:
+				self.extra = {}
+			self.extra[key] = value
+
+	def __delitem__(self, key: str):
+		if key == 'mtime' and self.mtime is not None:
+			self.mtime = None
+		elif self.extra is not None and key in self.extra:
+			del self.extra[key]
+		else:
+			raise KeyError(key)
+
+	def __iter__(self):
+		if self.mtime is not None:
+			yield 'mtime'
+		if self.extra is not None:
+			yield from self.extra
+
+	def __len__(self) -> int:
+		return (self.mtime is not None) + (len(self.extra) if self.extra is not None else 0)
+
+	def to_dict(self) -> dict:
+		blob = {} if self.mtime is None else {'mtime': self.mtime}
+		if self.extra is not None:
+			blob.update(self.extra)
+		return blob
+
+# the file type keys ("tracks", "images", "files") are always present and can't be replaced
+class Release(MutableMapping):
+	__slots__ = ('tracks', 'images', 'files', 'extra')
+
+	def __init__(self, columns: 'CompactLibrary', release: dict):
+		self.tracks = dict( (intern(k), Track(columns, v)) for k,v in release.get('tracks', {}).items() )
+		self.images = dict( (intern(k), File(v)) for k,v in release.get('images', {}).items() )
+		self.files = dict( (intern(k), File(v)) for k,v in release.get('files', {}).items() )
+		self.extra = dict( (k,v) for k,v in release.items() if k not in FILE_TYPES ) or None
+
+	def __getitem__(self, key: str):
+		if key in FILE_TYPES:
+			return getattr(self, key)
+		if self.extra is not None and key in self.extra:
+			return self.extra[key]
+		raise KeyError(key)
+
+	def __setitem__(self, key: str, value):
+		if key in FILE_TYPES:
+			raise Exception(f'The {key} of a compact release can\'t be replaced.')
+		if self.extra is None:
+			self.extra = {}
+		self.extra[key] = value
+
+	def __delitem__(self, key: str):
+		if key in FILE_TYPES:
+			raise Exception(f'The {key} of a compact release can\'t be removed.')
+		if self.extra is None or key not in self.extra:
+			raise KeyError(key)
+		del self.extra[key]
+
+	def __iter__(self):
+		yield from FILE_TYPES
+		if self.extra is not None:
+			yield from self.extra
+
+	def __len__(self) -> int:
+		return len(FILE_TYPES) + (len(self.extra) if self.extra is not None else 0)
+
+	def to_dict(self) -> dict:
+		release = {
+			'tracks': dict( (k, v.to_dict()) for k,v in self.tracks.items() ),
+			'images': dict( (k, v.to_dict()) for k,v in self.images.items() ),
+			'files': dict( (k, v.to_dict()) for k,v in self.files.items() )
+		}
+		if self.extra is not None:
+			release.update(self.extra)
+		return release
+
+# release_path: Release, releases set as dicts are converted
+# the column rows of removed releases are not reclaimed until the library is rebuilt
+class CompactLibrary(MutableMapping):
+	__slots__ = ('releases', *TRACK_COLUMNS)
+
+	def __init__(self, releases: dict|None = None):
+		self.releases: dict[str,Release] = {}
+		for column, typecode in TRACK_COLUMNS.items():
+			setattr(self, column, array(typecode))
+		if releases is not None:
+			for release_path, release in releases.items():
+				self.add_release(release_path, release)
+
+	# append the numeric track data to the columns and return the row number
+	# returns -1 if the data can't be stored in columns losslessly
+	def add_row(self, blob: dict) -> int:
+		for column, typecode in TRACK_COLUMNS.items():
+			value = blob.get(column)
+			if type(value) is not COLUMN_TYPES[typecode]:
+				return -1
+		row = len(self.rate)
+		try:
+			for column in TRACK_COLUMNS:
+				getattr(self, column).append(blob[column])
+		except OverflowError:
+			# roll back the partially added row
+			for column in TRACK_COLUMNS:
+				del getattr(self, column)[row:]
+			return -1
+		return row
+
+	# add a release in the dict form (e.g. right after scan_release)
+	def add_release(self, release_path: str, release: dict) -> Release:
+		self.releases[release_path] = Release(self, release)
+		return self.releases[release_path]
+
+	def __getitem__(self, release_path: str) -> Release:
+		return self.releases[release_path]
+
+	def __setitem__(self, release_path: str, release: dict):
+		if isinstance(release, Release):
+			self.releases[release_path] = release
+		else:
+			self.add_release(release_path, release)
+
+	def __delitem__(self, release_path: str):
+		del self.releases[release_path]
+
+	def __iter__(self):
+		return iter(self.releases)
+
+	def __len__(self) -> int:
+		return len(self.releases)
+
+	def to_dict(self) -> dict:
+		return dict( (k, v.to_dict()) for k,v in self.releases.items() )
@@ -1,4 +1,9 @@
+import hashlib
+import io
 import json
+import mmap
+import sqlite3
+import struct
 import mutagen._file
 import mutagen._vorbis
 import mutagen.apev2
@@ -7,14 +12,22 @@ import mutagen.easyid3
 import mutagen.easymp4
 import mutagen.id3
 import mutagen.mp4
+import numpy as np
+import r128gain
 import zstandard
 from PIL import Image
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import closing
 from copy import deepcopy
 from datetime import datetime
+from fnmatch import fnmatchcase
+from math import fsum
+from itertools import chain, repeat
 from natsort import natsorted
-from os import path, scandir, makedirs
+from os import path, scandir, makedirs, remove, replace, fsync, stat as os_stat
 from time import time
-from typing import Callable
+from typing import Callable, Iterable
 from wcmatch import wcmatch
 
 VERSION = '0.1'
@@ -24,6 +37,39 @@ MUSIC_EXTENSIONS = { # TODO
 		"LOSSY": ('mp3','opus','aac'),
 		"MIXED": ('wv','ac3', 'm4a', 'ogg', 'wma')
 		}
+# magic bytes used to classify files without opening them with mutagen or PIL
+# (offset, signature, kind), where kind is either 'audio', 'image' or 'other'
+# 'audio' files are still parsed with mutagen, 'image' and 'other' files are not opened at all
+FILE_SIGNATURES = [
+		(0, b'fLaC', 'audio'),
+		(0, b'ID3', 'audio'),
+		(0, b'OggS', 'audio'),
+		(0, b'MAC ', 'audio'),
+		(0, b'tBaK', 'audio'),
+		(0, b'wvpk', 'audio'),
+		(0, b'DSD ', 'audio'),
+		(0, b'MPCK', 'audio'),
+		(0, b'MP+', 'audio'),
+		(0, b'OFR ', 'audio'),
+		(0, b'FORM', 'audio'),
+		(0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11', 'audio'),	# ASF
+		(4, b'ftyp', 'audio'),
+		(8, b'WAVE', 'audio'),
+		(8, b'WEBP', 'image'),
+		(0, b'\xff\xd8\xff', 'image'),
+		(0, b'\x89PNG\r\n\x1a\n', 'image'),
+		(0, b'GIF8', 'image'),
+		(0, b'II*\x00', 'image'),
+		(0, b'MM\x00*', 'image'),
+		(0, b'%PDF', 'other'),
+		(0, b'PK\x03\x04', 'other'),
+		(0, b'Rar!', 'other'),
+		(0, b'7z\xbc\xaf\x27\x1c', 'other')
+		]
+SIGNATURE_LENGTH = 16
+# extensions of files that are neither audio nor images,
+# used when the header didn't match any signature
+OTHER_FILE_EXTENSIONS = ('log','cue','txt','nfo','m3u','m3u8','md5','sfv','ffp','accurip','url','htm','html','xml','json')
 
 # disable zipbomb protection (which prevents large images from loading
 # and is not really a concern if it's in your own music library anyway)
@@ -43,21 +89,435 @@ def db_gain(db: float):
 	return 10**(db/20)
 
 # a simple save function
+# the storage backend is chosen by the file extension (see SQLITE_EXTENSIONS and STREAM_EXTENSION)
+# the saved database includes all the journaled changes, so the journal is emptied
 def save_db(db: dict, db_path: str):
 	makedirs(path.dirname(db_path), exist_ok=True)
-	with open(db_path, 'wb') as file:
-		file.write( zstandard.compress(json.dumps(db, ensure_ascii=False, indent='\t').encode()) )
+	if is_sqlite_path(db_path):
+		save_db_sqlite(db, db_path)
+	elif is_stream_path(db_path):
+		save_db_stream(db, db_path)
+	else:
+		with open(db_path, 'wb') as file:
+			file.write( zstandard.compress(json.dumps(db, ensure_ascii=False, indent='\t').encode()) )
+	if path.isfile(journal_path(db_path)):
+		open(journal_path(db_path), 'wb').close()
 
 # a simple load function
+# changes logged to the journal after the last save are replayed
 def load_db(db_path: str) -> dict:
-	with open(db_path, 'rb') as file:
-		return json.loads(zstandard.decompress(file.read()))
+	if is_sqlite_path(db_path):
+		db = load_db_sqlite(db_path)
+	elif is_stream_path(db_path):
+		db = load_db_stream(db_path)
+	else:
+		with open(db_path, 'rb') as file:
+			db = json.loads(zstandard.decompress(file.read()))
+	replay_journal(db, journal_path(db_path))
+	return db
+
+# write-ahead journal for the changes made during uploads and deletions
+# it is an append-only file next to the database, each line being either
+#	["set", release_path, filetype, filename, key, value]	or
+#	["pop", release_path, filetype, filename, key]
+# where filetype and filename are null for the release fields
+# every entry is fsync'ed, so the progress is durable after every message
+JOURNAL_SUFFIX = '.journal'
+
+def journal_path(db_path: str) -> str:
+	return db_path+JOURNAL_SUFFIX
+
+class Journal:
+	# without a database path the changes are only applied to the dicts
+	def __init__(self, db_path: str|None = None):
+		self.db_path = db_path
+		self.entries = 0
+		self._file = None
+		if db_path is None:
+			return
+		# drop the partially written entry left by a crash, so that new entries don't get glued to it
+		if path.isfile(journal_path(db_path)):
+			with open(journal_path(db_path), 'r+b') as file:
+				data = file.read()
+				if len(data) > 0 and not data.endswith(b'\n'):
+					file.truncate(data.rfind(b'\n')+1)
+		self._file = open(journal_path(db_path), 'ab')
+
+	def _write(self, entry: list):
+		if self._file is not None:
+			self._file.write( encode_json_line(entry) )
+			self._file.flush()
+			fsync(self._file.fileno())
+			self.entries += 1
+
+	# set a release field, or a file field if filetype and filename are given
+	def set(self, release: dict, release_path: str, key: str, value,
+				filetype: str|None = None, filename: str|None = None):
+		target = release if filetype is None else release[filetype][filename]
+		target[key] = value
+		self._write(["set", release_path, filetype, filename, key, value])
+
+	# remove a release field, or a file field if filetype and filename are given
+	def pop(self, release: dict, release_path: str, key: str,
+				filetype: str|None = None, filename: str|None = None):
+		target = release if filetype is None else release[filetype][filename]
+		target.pop(key, None)
+		self._write(["pop", release_path, filetype, filename, key])
+
+	# save the database (which empties the journal) if enough entries were logged
+	def compact(self, db: dict, max_entries: int = 0):
+		if self.db_path is not None and self.entries >= max_entries:
+			save_db(db, self.db_path)
+			self.entries = 0
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+
+# apply the journaled changes to the database
+def replay_journal(db: dict, journal_file: str):
+	if not path.isfile(journal_file):
+		return
+	tags_changed = False
+	with open(journal_file, 'rb') as file:
+		for line in file:
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				# the last entry could have been only partially written before a crash
+				break
+			op, release_path, filetype, filename = entry[:4]
+			release = db["releases"].get(release_path)
+			if release is None:
+				continue
+			target = release if filetype is None else release[filetype].get(filename)
+			if target is None:
+				continue
+			if op == "set":
+				target[entry[4]] = entry[5]
+			elif op == "pop":
+				target.pop(entry[4], None)
+			tags_changed = tags_changed or entry[4] == "tags"
+	# the tags were changed outside of update_db (e.g. by analyze_gain),
+	# so the statistics and the tag index have to be rebuilt by the next update_db
+	if tags_changed:
+		db.pop("statistics_state", None)
+		db.pop("tag_index", None)
+
+# streaming zstd storage
+# the file is a sequence of compact JSON lines: the first one holds all the top-level keys
+# except "releases", and every next one holds a single [release_path, release] pair,
+# so neither saving nor loading ever needs the whole serialized database in memory
+STREAM_EXTENSION = '.jsonl.zst'
+
+def is_stream_path(db_path: str) -> bool:
+	return db_path.lower().endswith(STREAM_EXTENSION)
+
+def encode_json_line(data) -> bytes:
+	return json.dumps(data, ensure_ascii=False, separators=(',',':')).encode() + b'\n'
+
+# write JSON lines using the multithreaded streaming compressor
+# threads=-1 uses all the logical CPUs, dict_data is an optional trained dictionary (see train_db_dictionary)
+def write_json_lines(file_path: str, lines: Iterable, level: int = 3, threads: int = -1,
+				dict_data: zstandard.ZstdCompressionDict|None = None):
+	makedirs(path.dirname(file_path), exist_ok=True)
+	compressor = zstandard.ZstdCompressor(level=level, threads=threads, dict_data=dict_data)
+	with open(file_path, 'wb') as file, compressor.stream_writer(file, closefd=False) as writer:
+		for line in lines:
+			writer.write( encode_json_line(line) )
+
+# read JSON lines written by write_json_lines one by one
+def read_json_lines(file_path: str, dict_data: zstandard.ZstdCompressionDict|None = None):
+	decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+	with open(file_path, 'rb') as file, io.BufferedReader(decompressor.stream_reader(file)) as reader:
+		for line in reader:
+			yield json.loads(line)
+
+# save the database using the streaming compressor
+def save_db_stream(db: dict, db_path: str, level: int = 3, threads: int = -1,
+				dict_data: zstandard.ZstdCompressionDict|None = None):
+	write_json_lines(
+			db_path,
+			chain( [dict( (k,v) for k,v in db.items() if k != "releases" )], db["releases"].items() ),
+			level, threads, dict_data
+	)
+
+# load the database saved with save_db_stream
+def load_db_stream(db_path: str, dict_data: zstandard.ZstdCompressionDict|None = None) -> dict:
+	lines = read_json_lines(db_path, dict_data)
+	db = next(lines)
+	db["releases"] = dict( (release_path, release) for release_path, release in lines )
+	return db
+
+# train a zstd dictionary on the releases of the given database
+# it improves the compression of small per-release chunks and has to be passed to both save and load
+def train_db_dictionary(db: dict, dict_size: int = 112640) -> zstandard.ZstdCompressionDict:
+	return zstandard.train_dictionary(
+			dict_size,
+			[encode_json_line(release) for release in db["releases"].items()]
+	)
+
+# SQLite storage backend
+# every release is stored as a separate row, so single releases can be updated
+# and loaded without touching the rest of the database
+# all the other top-level keys (root, statistics, ...) are stored in the meta table
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3')
+
+def is_sqlite_path(db_path: str) -> bool:
+	return path.splitext(db_path)[1].lower() in SQLITE_EXTENSIONS
+
+# open the SQLite database, creating the tables if needed
+def open_db_sqlite(db_path: str) -> sqlite3.Connection:
+	connection = sqlite3.connect(db_path)
+	connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+	connection.execute("CREATE TABLE IF NOT EXISTS releases (path TEXT PRIMARY KEY, data TEXT NOT NULL)")
+	return connection
+
+# save the database to SQLite
+# if given a list of release paths, only those are written (the rest are assumed unchanged),
+# otherwise all releases are written and the ones missing from the dict are removed
+def save_db_sqlite(db: dict, db_path: str, releases: Iterable[str]|None = None):
+	with closing(open_db_sqlite(db_path)) as connection, connection:
+		# rewrite the whole meta table, so the keys removed from the dict (e.g. statistics_state) are gone
+		connection.execute("DELETE FROM meta")
+		connection.executemany(
+				"INSERT INTO meta (key, value) VALUES (?, ?)",
+				[(key, json.dumps(value, ensure_ascii=False)) for key, value in db.items() if key != "releases"]
+		)
+		if releases is None:
+			stored = set( row[0] for row in connection.execute("SELECT path FROM releases") )
+			connection.executemany(
+					"DELETE FROM releases WHERE path = ?",
+					[(release_path,) for release_path in stored - db["releases"].keys()]
+			)
+			releases = db["releases"].keys()
+		upsert_releases_sqlite(connection, dict( (k, db["releases"][k]) for k in releases ))
+
+# insert or replace the given releases
+def upsert_releases_sqlite(connection: sqlite3.Connection, releases: dict):
+	connection.executemany(
+			"INSERT OR REPLACE INTO releases (path, data) VALUES (?, ?)",
+			[(release_path, json.dumps(release, ensure_ascii=False)) for release_path, release in releases.items()]
+	)
+
+# remove the given releases
+def delete_releases_sqlite(connection: sqlite3.Connection, release_paths: Iterable[str]):
+	connection.executemany(
+			"DELETE FROM releases WHERE path = ?",
+			[(release_path,) for release_path in release_paths]
+	)
+
+# load the database from SQLite
+# if given a list of release paths, only those releases are loaded
+def load_db_sqlite(db_path: str, releases: Iterable[str]|None = None) -> dict:
+	if not path.isfile(db_path):
+		raise FileNotFoundError(db_path)
+	with closing(open_db_sqlite(db_path)) as connection:
+		db = dict( (key, json.loads(value)) for key, value in connection.execute("SELECT key, value FROM meta") )
+		if releases is None:
+			rows = connection.execute("SELECT path, data FROM releases")
+		else:
+			rows = (
+				row
+				for release_path in releases
+				for row in connection.execute("SELECT path, data FROM releases WHERE path = ?", (release_path,))
+			)
+		db["releases"] = dict( (release_path, json.loads(data)) for release_path, data in rows )
+	db["releases"] = dict( natsorted(db["releases"].items(), key=lambda x: x[0]) )
+	return db
+
+# convert the database between storage backends (e.g. from .zstd to .sqlite)
+def migrate_db(src_path: str, dst_path: str):
+	save_db(load_db(src_path), dst_path)
+
+# read-only release index for the query functions
+# file layout:
+#	header:		magic, meta offset, meta length, index offset, index length
+#	releases:	compact JSON of each release, one after another
+#	meta:		JSON of all the other top-level keys
+#	index:		JSON in such form: release_path: [offset, length]
+# it is mmap'ed, so opening it is almost instant and only the accessed releases are decoded
+RELEASE_INDEX_MAGIC = b'DSPTIDX1'
+RELEASE_INDEX_HEADER = struct.Struct('<8sQQQQ')
+
+# write the read-only release index for the given database
+def save_release_index(db: dict, index_path: str):
+	makedirs(path.dirname(index_path), exist_ok=True)
+	with open(index_path, 'wb') as file:
+		file.write(b'\0'*RELEASE_INDEX_HEADER.size)
+		index = {}
+		offset = RELEASE_INDEX_HEADER.size
+		for release_path, release in db["releases"].items():
+			data = json.dumps(release, ensure_ascii=False, separators=(',',':')).encode()
+			file.write(data)
+			index[release_path] = [offset, len(data)]
+			offset += len(data)
+		meta = json.dumps(dict( (k,v) for k,v in db.items() if k != "releases" ), ensure_ascii=False).encode()
+		file.write(meta)
+		index_data = json.dumps(index, ensure_ascii=False, separators=(',',':')).encode()
+		file.write(index_data)
+		file.seek(0)
+		file.write(RELEASE_INDEX_HEADER.pack(
+				RELEASE_INDEX_MAGIC,
+				offset, len(meta),
+				offset+len(meta), len(index_data)
+		))
+
+# mapping-like view of the releases stored in a release index file
+# releases are decoded on every access, nothing is cached
+class ReleaseIndex(Mapping):
+	def __init__(self, index_path: str):
+		self._file = open(index_path, 'rb')
+		try:
+			self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		except Exception:
+			self._file.close()
+			raise
+		magic, meta_offset, meta_length, index_offset, index_length = \
+				RELEASE_INDEX_HEADER.unpack_from(self._mmap, 0)
+		if magic != RELEASE_INDEX_MAGIC:
+			self.close()
+			raise Exception(f"Not a release index: '{index_path}'")
+		self.meta = json.loads(self._mmap[meta_offset:meta_offset+meta_length])
+		self._index = json.loads(self._mmap[index_offset:index_offset+index_length])
+
+	def __getitem__(self, release_path: str) -> dict:
+		offset, length = self._index[release_path]
+		return json.loads(self._mmap[offset:offset+length])
+
+	def __iter__(self):
+		return iter(self._index)
+
+	def __len__(self) -> int:
+		return len(self._index)
+
+	def __contains__(self, release_path) -> bool:
+		return release_path in self._index
+
+	def close(self):
+		self._mmap.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+# open the release index as a read-only database dict
+# "releases" is a ReleaseIndex, which can be passed to the query functions as is
+def load_release_index(index_path: str) -> dict:
+	releases = ReleaseIndex(index_path)
+	return {**releases.meta, "releases": releases}
 
 # a simple backup function
+# backups are written with the streaming writer and can be loaded with load_db
 def backup_db(db: dict, root: str):
+	save_db_stream(db, path.join(root,f"{datetime.today()}{STREAM_EXTENSION}"))
+
+# incremental backups
+# the backup directory holds base snapshots and per-run deltas:
+#	"<date>.base.jsonl.zst"		full database, same format as save_db_stream
+#	"<date>.delta.jsonl.zst"	the first line holds all the top-level keys except "releases",
+#								the next ones are either ["set", release_path, release] or ["del", release_path]
+#	"index.json"				release hashes of the latest backup, used to find the changed releases
+BACKUP_BASE_SUFFIX = '.base'+STREAM_EXTENSION
+BACKUP_DELTA_SUFFIX = '.delta'+STREAM_EXTENSION
+BACKUP_INDEX = 'index.json'
+
+def hash_release(release: dict) -> str:
+	return hashlib.blake2b(encode_json_line(release), digest_size=16).hexdigest()
+
+# list the incremental backups sorted by date
+# returns a list of (date, kind, file_path) tuples, where kind is either 'base' or 'delta'
+def list_backups(root: str) -> list[tuple[datetime,str,str]]:
+	backups = []
+	if not path.isdir(root):
+		return backups
+	for entry in scandir(root):
+		for kind, suffix in (('base', BACKUP_BASE_SUFFIX), ('delta', BACKUP_DELTA_SUFFIX)):
+			if entry.name.endswith(suffix):
+				try:
+					backups.append( (datetime.fromisoformat(entry.name.removesuffix(suffix)), kind, entry.path) )
+				except ValueError:
+					pass
+	return sorted(backups)
+
+# make an incremental backup
+# a base snapshot is written every base_interval backups, and a delta from the previous backup otherwise
+# returns the path of the written file
+def backup_db_incremental(db: dict, root: str, base_interval: int = 10) -> str:
 	makedirs(root, exist_ok=True)
-	with open(path.join(root,f"{datetime.today()}.zstd"), 'wb') as file:
-		file.write( zstandard.compress(json.dumps(db, ensure_ascii=False, indent='\t').encode()) )
+	index_path = path.join(root, BACKUP_INDEX)
+	hashes = dict( (release_path, hash_release(release)) for release_path, release in db["releases"].items() )
+	index = None
+	if path.isfile(index_path):
+		with open(index_path, 'r') as file:
+			index = json.load(file)
+	backups = list_backups(root)
+	date = datetime.today()
+	# the index is only usable if it describes the latest existing backup
+	if ( index is None
+			or len(backups) == 0
+			or index["date"] != str(backups[-1][0])
+			or index["deltas"]+1 >= base_interval ):
+		file_path = path.join(root, f"{date}{BACKUP_BASE_SUFFIX}")
+		save_db_stream(db, file_path)
+		deltas = 0
+	else:
+		old_hashes = index["releases"]
+		file_path = path.join(root, f"{date}{BACKUP_DELTA_SUFFIX}")
+		write_json_lines(file_path, chain(
+				[dict( (k,v) for k,v in db.items() if k != "releases" )],
+				( ["del", release_path] for release_path in old_hashes.keys() - hashes.keys() ),
+				( ["set", release_path, db["releases"][release_path]]
+					for release_path, release_hash in hashes.items()
+					if old_hashes.get(release_path) != release_hash )
+		))
+		deltas = index["deltas"]+1
+	# write the index atomically, so that a crash never leaves it inconsistent with the backups
+	with open(index_path+'.tmp', 'w') as file:
+		json.dump({"date": str(date), "deltas": deltas, "releases": hashes}, file, ensure_ascii=False)
+	replace(index_path+'.tmp', index_path)
+	return file_path
+
+# apply a delta backup to the database in place
+def apply_backup_delta(db: dict, delta_path: str):
+	lines = read_json_lines(delta_path)
+	releases = db.pop("releases")
+	db.clear()
+	db.update(next(lines))
+	db["releases"] = releases
+	for line in lines:
+		if line[0] == "set":
+			releases[line[1]] = line[2]
+		elif line[0] == "del":
+			releases.pop(line[1], None)
+
+# restore the database as it was at the given date (the latest backup if None)
+def restore_db(root: str, date: datetime|None = None) -> dict:
+	backups = [backup for backup in list_backups(root) if date is None or backup[0] <= date]
+	bases = [number for number, backup in enumerate(backups) if backup[1] == 'base']
+	if len(bases) == 0:
+		raise Exception(f"No base backup found in '{root}' before {date}.")
+	db = load_db_stream(backups[bases[-1]][2])
+	for _, _, delta_path in backups[bases[-1]+1:]:
+		apply_backup_delta(db, delta_path)
+	return db
+
+# retention policy: keep the newest "keep" restore points
+# older deltas are compacted into a base snapshot at the oldest kept point, and the rest is removed
+def prune_backups(root: str, keep: int = 30):
+	backups = list_backups(root)
+	if len(backups) <= keep:
+		return
+	oldest = len(backups)-keep
+	date, kind, file_path = backups[oldest]
+	if kind == 'delta':
+		save_db_stream(restore_db(root, date), path.join(root, f"{date}{BACKUP_BASE_SUFFIX}"))
+		remove(file_path)
+	for _, _, file_path in backups[:oldest]:
+		remove(file_path)
 
 # split tag by slash
 def split_tags(tags: dict):
@@ -72,6 +532,34 @@ def split_tags(tags: dict):
 		if len(disc_info) == 2:
 			tags["totaldiscs"] = [disc_info[1]]
 
+# map already loaded ID3 frames or MP4 atoms to the humanly EasyID3/EasyMP4 keys
+# uses the public key registries (Get and List) of the Easy* classes on the parsed tags,
+# so the file isn't opened twice
+def easy_tags(tags: mutagen.id3.ID3|mutagen.mp4.MP4Tags) -> dict[str,list[str]]:
+	if isinstance(tags, mutagen.id3.ID3):
+		registry = mutagen.easyid3.EasyID3
+	elif isinstance(tags, mutagen.mp4.MP4Tags):
+		registry = mutagen.easymp4.EasyMP4Tags
+	else:
+		raise Exception(f"Unsupported tag type: {type(tags)}")
+	easy = {}
+	for key in registry.Get:
+		# wildcard keys (e.g. "performer:*") list the keys present in the tags,
+		# which may belong to other patterns too (replaygain_*_gain lists the peaks as well)
+		for listed_key in registry.List[key](tags, key) if key in registry.List else [key]:
+			if listed_key in easy:
+				continue
+			# resolve the getter like the Easy* classes do: the exact key first, then the patterns
+			getter = registry.Get.get(listed_key) or next(
+					(getter for pattern, getter in registry.Get.items() if fnmatchcase(listed_key, pattern)),
+					None
+			)
+			try:
+				easy[listed_key] = getter(tags, listed_key)
+			except KeyError:
+				pass
+	return easy
+
 # form a blob with audio file information
 def form_audio_blob(mutafile):
 	info = mutafile.info
@@ -89,9 +577,8 @@ def form_audio_blob(mutafile):
 	if isinstance(tags, mutagen.id3.ID3):
 		# detect embedded image
 		blob["embedded_image"] = 'APIC:' in tags.keys()
-		# use EasyID3 to get the tags in humanly form
-		easy_tags = mutagen.easyid3.EasyID3(mutafile.filename)
-		blob["tags"] = dict( easy_tags.items() )
+		# use EasyID3 mapping to get the tags in humanly form
+		blob["tags"] = easy_tags(tags)
 		# then, try to split the tracknumber into tracknumber and totaltracks,
 		# since ID3 spec thinks that it's a god idea to save them together
 		split_tags(blob["tags"])
@@ -125,10 +612,7 @@ def form_audio_blob(mutafile):
 					blob["tags"][key] = [str(item.value)]
 	elif isinstance(tags, mutagen.mp4.MP4Tags):
 		blob["embedded_image"] = "covr" in tags
-		tags = mutagen.easymp4.EasyMP4(mutafile.filename).tags
-		if tags is None:
-			raise Exception(f"Could not open tags: '{mutafile.filename}'")
-		blob["tags"] = dict( tags.items() )
+		blob["tags"] = easy_tags(tags)
 		split_tags(blob["tags"])
 	elif isinstance(tags, mutagen._vorbis.VCommentDict):
 		blob["embedded_image"] = ("metadata_block_picture" in tags) \
@@ -157,16 +641,90 @@ def form_audio_blob(mutafile):
 	blob["tags"] = dict( natsorted(blob["tags"].items()) )
 	return blob
 
+# guess the file kind based on its header and extension
+# returns either 'audio', 'image', 'other' or None if the header is ambiguous
+def classify_file(file_path: str) -> str|None:
+	try:
+		with open(file_path, 'rb') as file:
+			header = file.read(SIGNATURE_LENGTH)
+	except OSError:
+		return None
+	for offset, signature, kind in FILE_SIGNATURES:
+		if header[offset:offset+len(signature)] == signature:
+			return kind
+	if path.splitext(file_path)[1].lower()[1:] in OTHER_FILE_EXTENSIONS:
+		return 'other'
+	return None
+
 # generate a list of releases nested under some directory
-def gen_release_list(root: str) -> list[str]:
+# if given a directory index (see gen_release_list_indexed), use it instead of globbing the whole tree
+def gen_release_list(root: str, dir_index: dict|None = None) -> list[str]:
+	if dir_index is not None:
+		return gen_release_list_indexed(root, dir_index)
 	return natsorted(set( path.dirname(file) for file in wcmatch.WcMatch(
 				root,
 				'|'.join(['*.'+ext for ext_list in MUSIC_EXTENSIONS.values() for ext in ext_list]),
 				flags=wcmatch.RECURSIVE|wcmatch.IGNORECASE|wcmatch.SYMLINKS
 			).match() ))
 
+# generate a list of releases using a persistent directory index
+# the index is updated in place and has such form:
+#	dir_path: {mtime: float, inode: int, subdirs: [str], release: bool}
+# directory mtime only changes when entries are added, removed or renamed,
+# so unchanged directories are not listed again, only stat'ed
+def gen_release_list_indexed(root: str, dir_index: dict) -> list[str]:
+	extensions = set( ext for ext_list in MUSIC_EXTENSIONS.values() for ext in ext_list )
+	new_index = {}
+	releases = []
+	# protect from symlink loops
+	visited = set()
+	stack = [root]
+	while stack:
+		dir_path = stack.pop()
+		try:
+			stat = os_stat(dir_path)
+		except OSError:
+			continue
+		if (stat.st_dev, stat.st_ino) in visited:
+			continue
+		visited.add( (stat.st_dev, stat.st_ino) )
+		entry = dir_index.get(dir_path)
+		if entry is None or entry["mtime"] != stat.st_mtime or entry["inode"] != stat.st_ino:
+			entry = {
+				"mtime": stat.st_mtime,
+				"inode": stat.st_ino,
+				"subdirs": [],
+				"release": False
+			}
+			try:
+				with scandir(dir_path) as entries:
+					for dir_entry in entries:
+						# hidden entries are ignored, same as with wcmatch
+						if dir_entry.name.startswith('.'):
+							continue
+						try:
+							if dir_entry.is_dir(follow_symlinks=True):
+								entry["subdirs"].append(dir_entry.name)
+							elif ( not entry["release"]
+									and path.splitext(dir_entry.name)[1].lower()[1:] in extensions
+									and dir_entry.is_file(follow_symlinks=True) ):
+								entry["release"] = True
+						except OSError:
+							pass
+			except OSError:
+				continue
+		new_index[dir_path] = entry
+		if entry["release"]:
+			releases.append(dir_path)
+		stack.extend( path.join(dir_path, subdir) for subdir in entry["subdirs"] )
+	# drop directories that no longer exist
+	dir_index.clear()
+	dir_index.update(new_index)
+	return natsorted(releases)
+
 # generate a release dict for the given directory
-def scan_release(release_path: str, mtime_only: bool = False, callback: Callable = lambda **d: None) -> dict:
+# if a compact library (see compact.py) is given, the release is added to it and its compact form is returned
+def scan_release(release_path: str, mtime_only: bool = False, callback: Callable = lambda **d: None, library = None) -> dict:
 	release = {} if mtime_only else {
 										"tracks": {},
 										"images": {},
@@ -194,8 +752,11 @@ def scan_release(release_path: str, mtime_only: bool = False, callback: Callable
 			if mtime_only:
 				release[entry.name] = blob
 				continue
+			# sniff the header to avoid opening images and other files with mutagen and PIL
+			kind = classify_file(entry_path)
 			# do not try opening certain extensions with mutagen
-			if path.splitext(entry.name)[1].lower()[1:] not in OVERRIDDEN_FILE_EXTENSIONS:
+			if ( kind not in ('image','other')
+					and path.splitext(entry.name)[1].lower()[1:] not in OVERRIDDEN_FILE_EXTENSIONS ):
 				# try opening the file as audio
 				try:
 					mutafile = mutagen._file.File(entry_path)
@@ -209,32 +770,116 @@ def scan_release(release_path: str, mtime_only: bool = False, callback: Callable
 					blob.update( form_audio_blob(mutafile) )
 					release["tracks"][entry.name] = blob
 					continue
-			# if mutagen was skipped or didn't open it as audio, try opening it as an image
-			try:
-				Image.open(entry_path).verify()
+			if kind == 'image':
 				release["images"][entry.name] = blob
-			except Exception:
+			elif kind == 'other':
 				release["files"][entry.name] = blob
+			# if the header was ambiguous and mutagen was skipped or didn't open it as audio,
+			# try opening it as an image
+			else:
+				try:
+					Image.open(entry_path).verify()
+					release["images"][entry.name] = blob
+				except Exception:
+					release["files"][entry.name] = blob
 	for ftype in release:
 		if ftype == {}:
 			release.pop(ftype)
+	if not mtime_only:
+		release["fingerprint"] = release_fingerprint(release)
+		if library is not None:
+			return library.add_release(release_path, release)
 	return release
 
+# calculate a content fingerprint of a release, used to detect moved releases
+# it covers file names and scanned data (mtimes, lengths, tags, etc.), but not the upload fields,
+# so it can be calculated from both fresh scans and database entries
+def release_fingerprint(release: dict) -> str:
+	content = {
+		filetype: {
+			name: {k: v for k, v in blob.items() if not k.startswith(('id_','link_'))}
+			for name, blob in release[filetype].items()
+		}
+		for filetype in ("tracks","images","files")
+	}
+	return hashlib.blake2b(
+			json.dumps(content, ensure_ascii=False, sort_keys=True).encode(),
+			digest_size=16
+	).hexdigest()
+
+# get the stored release fingerprint or calculate it for releases scanned without one
+def get_release_fingerprint(release: dict) -> str:
+	if "fingerprint" in release:
+		return release["fingerprint"]
+	return release_fingerprint(release)
+
+# map fingerprints to the paths of releases having them
+def index_fingerprints(releases: dict) -> dict[str,list[str]]:
+	index: dict[str,list[str]] = {}
+	for release_path, release in releases.items():
+		index.setdefault(get_release_fingerprint(release), []).append(release_path)
+	return index
+
+# scan a release in a worker process, recording the callback events
+# so that they can be replayed by the parent process
+def _scan_release_recorded(release_path: str, mtime_only: bool = False) -> tuple[dict,list[dict]]:
+	events = []
+	release = scan_release(release_path, mtime_only, lambda **d: events.append(d))
+	return release, events
+
+# scan multiple releases, optionally using a process pool
+# yields (release_path, release) tuples in the order of the given list,
+# callback receives scan_release events extended with release and scanned_releases
+# with a compact library given, the releases are added to it and yielded in their compact form
+def scan_releases(
+			release_paths: list[str],
+			mtime_only: bool = False,
+			workers: int = 1,
+			callback: Callable = lambda **d: None,
+			library = None
+	):
+	if workers <= 1 or len(release_paths) <= 1:
+		for release_number, release_path in enumerate(release_paths):
+			yield release_path, scan_release(
+					release_path,
+					mtime_only,
+					lambda **d: callback(release=release_path, scanned_releases=release_number, **d),
+					library
+			)
+		return
+	with ProcessPoolExecutor(workers) as executor:
+		# executor.map returns the results in submission order, so the progress
+		# events are delivered in the same order as in the serial scan
+		results = executor.map(
+				_scan_release_recorded,
+				release_paths,
+				repeat(mtime_only),
+				chunksize=max(1, len(release_paths)//(workers*16))
+		)
+		for release_number, (release_path, (release, events)) in enumerate(zip(release_paths, results)):
+			for event in events:
+				callback(release=release_path, scanned_releases=release_number, **event)
+			if library is not None and not mtime_only:
+				release = library.add_release(release_path, release)
+			yield release_path, release
+
+# find the only release with the same content as the given one
 def find_similar_release(releases: dict, release_src: dict) -> str|None:
-	release = release_src
-	if 'id_orig' in release.keys():
-		release.pop('id_orig')
-	if 'id_opus' in release.keys():
-		release.pop('id_opus')
-	key = [k for k, v in releases.items() if v == release]
+	fingerprint = get_release_fingerprint(release_src)
+	key = [k for k, v in releases.items() if get_release_fingerprint(v) == fingerprint]
 	if len(key) == 1:
 		return key[0]
 
 # returns tuple in such form: (deleted_releases, modified_releases, new_scans)
-def update_db(db: dict, trust_mtime: bool = True, critical_tags: list[str] = [], wanted_tags: list[str] = [], callback: Callable = lambda **d: None) -> tuple[dict,dict]:
+# workers > 1 enables scanning releases in a process pool
+# verify_statistics checks the incrementally updated statistics against a full recompute
+def update_db(db: dict, trust_mtime: bool = True, critical_tags: list[str] = [], wanted_tags: list[str] = [], callback: Callable = lambda **d: None, workers: int = 1, verify_statistics: bool = False) -> tuple[dict,dict]:
+	old_release_count = len(db["releases"])
+	# the tag index can only be updated incrementally if it describes the current releases
+	tag_index_valid = "tag_index" in db and db["tag_index"]["tracks"].keys() == db["releases"].keys()
 	# generate fresh release list and get the old one
 	callback(operation="generating release list")
-	release_list = gen_release_list(db["root"])
+	release_list = gen_release_list(db["root"], db.setdefault("directories", {}))
 	old_release_list = db["releases"].keys()
 	# init new lists
 	# note that "modified_releases" is more like "either modified or not modified releases"
@@ -242,44 +887,53 @@ def update_db(db: dict, trust_mtime: bool = True, critical_tags: list[str] = [],
 	potentially_new, potentially_deleted, potentially_modified = comm(release_list, old_release_list)
 	modified_releases = {}
 	# detect new and remove unmodified releases from "modified_releases"
-	scanned_releases = 0
-	for release in potentially_modified:
-		scan_callback = lambda file,total_files,scanned_files: callback(
-				operation =			"scanning old releases",
-				release_count =		len(potentially_modified),
-				scanned_releases =	scanned_releases,
-				release =			release,
-				file =				file,
-				total_files =		total_files,
-				scanned_files =		scanned_files
-		)
+	scan_callback = lambda release_count: lambda release,scanned_releases,file,total_files,scanned_files: callback(
+			operation =			"scanning old releases",
+			release_count =		release_count,
+			scanned_releases =	scanned_releases,
+			release =			release,
+			file =				file,
+			total_files =		total_files,
+			scanned_files =		scanned_files
+	)
+	changed_releases = []
+	for release, files in scan_releases(
+				potentially_modified,
+				mtime_only=trust_mtime,
+				workers=workers,
+				callback=scan_callback(len(potentially_modified))
+		):
 		if trust_mtime:
-			files = scan_release(release, mtime_only=True, callback=scan_callback)
 			old_files = dict(
 					(name,{"mtime":data["mtime"]})
 					for filetype in ("tracks","images","files")
 					for name,data in db["releases"][release][filetype].items()
 			)
 		else:
-			files = scan_release(release, callback=scan_callback)
 			old_files = dict(
 					(name,data)
 					for filetype in ("tracks","images","files")
 					for name,data in db["releases"][release][filetype].items()
 			)
-		scanned_releases += 1
 		# if file list and corresponding data is the same,
 		# release hasn't changed, so remove it from modified
 		if files != old_files:
 			modified_releases[release] = deepcopy(db['releases'][release])
 			if trust_mtime:
-				db['releases'][release] = scan_release(release, callback=scan_callback)
+				changed_releases.append(release)
 			else:
 				db['releases'][release] = files
-	scanned_releases = 0
-	new_scans = {}
-	for release in potentially_new:
-		scan_callback = lambda file,total_files,scanned_files: callback(
+	# with trusted mtimes only the changed releases need a full rescan
+	for release, files in scan_releases(
+				changed_releases,
+				workers=workers,
+				callback=scan_callback(len(changed_releases))
+		):
+		db['releases'][release] = files
+	new_scans = dict(scan_releases(
+			potentially_new,
+			workers=workers,
+			callback=lambda release,scanned_releases,file,total_files,scanned_files: callback(
 				operation =			"scanning new releases",
 				release_count =		len(potentially_new),
 				scanned_releases =	scanned_releases,
@@ -287,37 +941,182 @@ def update_db(db: dict, trust_mtime: bool = True, critical_tags: list[str] = [],
 				file =				file,
 				total_files =		total_files,
 				scanned_files =		scanned_files
-		)
-		new_scans[release] = scan_release(release, callback=scan_callback)
-		scanned_releases += 1
+			)
+	))
 	del potentially_new
 	### at this point all the release data is correct and usable
 	# try finding "new" releases exactly the same as a "deleted" releases
 	move = {}
 	deleted_releases = {}
+	fingerprint_index = index_fingerprints(new_scans)
 	for release_number, release in enumerate(potentially_deleted):
 		callback(
 				operation="searching for moved releases",
 				release_count=len(potentially_deleted),
 				scanned_releases=release_number-1
 		)
-		key = find_similar_release(new_scans, db["releases"][release])
-		if key is not None:
-			move[key] = release
+		keys = fingerprint_index.get(get_release_fingerprint(db["releases"][release]), [])
+		# only unambiguous matches are treated as moves
+		if len(keys) == 1:
+			move[keys.pop()] = release
 		else:
 			deleted_releases[release] = deepcopy(db['releases'][release])
 	# move releases, moved in library, to their new paths
 	for key,release in move.items():
 		db["releases"][key] = db["releases"].pop(release)
+		db["releases"][key]["fingerprint"] = new_scans[key]["fingerprint"]
 		potentially_deleted.remove(release)
 		new_scans.pop(key)
 		print(f"Moved '{release}' to '{key}'")
 	db["releases"].update(new_scans)
 	callback(operation="calculating statistics")
-	db["statistics"] = calc_stats(db["releases"], critical_tags, wanted_tags)
+	# deleted releases are kept in the database until the caller removes them with remove_releases,
+	# so only modified releases are subtracted
+	added_releases = set([*modified_releases.keys(), *new_scans.keys()])
+	statistics_state = {
+		"critical_tags": critical_tags,
+		"wanted_tags": wanted_tags,
+		"release_count": len(db["releases"])
+	}
+	# the incremental update is only possible if the releases weren't changed outside of update_db
+	# and the stored contributions were calculated with the same tag lists
+	if ( "statistics" in db
+			and db.get("statistics_state") == {**statistics_state, "release_count": old_release_count}
+			and all( "statistics" in release for release in modified_releases.values() )
+			and all( "statistics" in release
+				for release_path, release in db["releases"].items()
+				if release_path not in added_releases ) ):
+		db["statistics"] = update_stats(
+				db["statistics"],
+				db["releases"],
+				modified_releases.values(),
+				added_releases,
+				critical_tags,
+				wanted_tags
+		)
+	else:
+		db["statistics"] = calc_stats(db["releases"], critical_tags, wanted_tags)
+	db["statistics_state"] = statistics_state
+	callback(operation="updating tag index")
+	if tag_index_valid:
+		for release_path in modified_releases.keys():
+			remove_from_tag_index(db["tag_index"], release_path)
+			add_to_tag_index(db["tag_index"], release_path, db["releases"][release_path])
+		for key, release in move.items():
+			remove_from_tag_index(db["tag_index"], release)
+			add_to_tag_index(db["tag_index"], key, db["releases"][key])
+		for release_path in new_scans.keys():
+			add_to_tag_index(db["tag_index"], release_path, db["releases"][release_path])
+	else:
+		db["tag_index"] = build_tag_index(db["releases"])
+	if verify_statistics and not verify_stats(db, critical_tags, wanted_tags):
+		raise Exception("Incrementally updated statistics differ from the full recompute.")
 	db["update_time"] = time()
 	return deleted_releases, modified_releases
 
+# remove releases from the database, e.g. the deleted ones returned by update_db once they are deleted from telegram
+# their stored statistics contributions and tag index entries are subtracted, so the next update_db stays incremental
+# returns the removed releases
+def remove_releases(db: dict, release_paths: Iterable[str]) -> dict[str,dict]:
+	release_count = len(db["releases"])
+	removed = {}
+	for release_path in release_paths:
+		if release_path in db["releases"]:
+			removed[release_path] = db["releases"].pop(release_path)
+	if len(removed) == 0:
+		return removed
+	state = db.get("statistics_state")
+	if ( "statistics" in db and state is not None
+			and state["release_count"] == release_count
+			and all( "statistics" in release for release in removed.values() ) ):
+		db["statistics"] = update_stats(
+				db["statistics"],
+				db["releases"],
+				removed.values(),
+				[],
+				state["critical_tags"],
+				state["wanted_tags"]
+		)
+		state["release_count"] = len(db["releases"])
+	else:
+		# the stored statistics can't be updated, so make update_db recalculate them
+		db.pop("statistics_state", None)
+	if "tag_index" in db:
+		for release_path in removed.keys():
+			remove_from_tag_index(db["tag_index"], release_path)
+	return removed
+
+# inverted tag index, in such form:
+#	tracks:		{release_path: track_count}
+#	extensions:	{release_path: [distinct track extensions]}
+#	tags:		{tag: {release_path: {count: tracks_having_the_tag, values: [distinct first values]}}}
+# tracks lacking a tag are the ones in releases where the tag count is lower than the track count
+
+# add a release to the tag index
+def add_to_tag_index(tag_index: dict, release_path: str, release: dict):
+	tag_index["tracks"][release_path] = len(release["tracks"])
+	extensions = []
+	for track_name, track in release["tracks"].items():
+		ext = path.splitext(track_name)[1]
+		if ext not in extensions:
+			extensions.append(ext)
+		for tag, values in track["tags"].items():
+			entry = tag_index["tags"].setdefault(tag, {}).setdefault(release_path, {"count": 0, "values": []})
+			entry["count"] += 1
+			if values[0] not in entry["values"]:
+				entry["values"].append(values[0])
+	tag_index["extensions"][release_path] = extensions
+
+# remove a release from the tag index
+def remove_from_tag_index(tag_index: dict, release_path: str):
+	tag_index["tracks"].pop(release_path, None)
+	tag_index["extensions"].pop(release_path, None)
+	for tag in [*tag_index["tags"].keys()]:
+		tag_index["tags"][tag].pop(release_path, None)
+		if len(tag_index["tags"][tag]) == 0:
+			tag_index["tags"].pop(tag)
+
+# build the tag index for the given releases
+def build_tag_index(releases: dict) -> dict:
+	tag_index = {"tracks": {}, "extensions": {}, "tags": {}}
+	for release_path, release in releases.items():
+		add_to_tag_index(tag_index, release_path, release)
+	return tag_index
+
+# report all the library issues at once:
+#	missing_tags:		{tag: {release_path: [track_paths]}}, same as find_tracks_lacking_tag
+#	mixed_tags:			{tag: [release_paths]}, same as find_multi_tag_releases
+#	mixed_extensions:	[release_paths], same as find_multi_ext_releases
+# if no tag index is given, it is built in a single pass over the tracks,
+# otherwise only the releases lacking some tags are walked
+def report_issues(releases: dict,
+				critical_tags: list[str] = [],
+				wanted_tags: list[str] = [],
+				tag_index: dict|None = None) -> dict:
+	if tag_index is None:
+		tag_index = build_tag_index(releases)
+	checked_tags = [*dict.fromkeys([*critical_tags, *wanted_tags])]
+	report = {
+		"missing_tags": {},
+		"mixed_tags": {},
+		"mixed_extensions": [ release_path
+				for release_path, extensions in tag_index["extensions"].items()
+				if len(extensions) > 1 ]
+	}
+	for tag in checked_tags:
+		tag_releases = tag_index["tags"].get(tag, {})
+		missing = {}
+		for release_path, track_count in tag_index["tracks"].items():
+			if release_path in releases and tag_releases.get(release_path, {"count": 0})["count"] < track_count:
+				missing[release_path] = [ path.join(release_path, track_name)
+						for track_name, track in releases[release_path]["tracks"].items()
+						if tag not in track["tags"] ]
+		report["missing_tags"][tag] = missing
+		report["mixed_tags"][tag] = [ release_path
+				for release_path, entry in tag_releases.items()
+				if len(entry["values"]) > 1 ]
+	return report
+
 # find a list of tracks lacking tags
 def find_tracks_lacking_tag(releases: dict, tag: str) -> dict[str,list[str]]:
 	found: dict = {}
@@ -356,39 +1155,429 @@ def find_multi_tag_releases(releases: dict, tag: str) -> list[str]:
 					break
 	return found
 
+# parse gain tag string like "-7.32 dB" or "-18 LUFS"
+def parse_gain(gain_db: str) -> float:
+	return float( gain_db.lower().removesuffix('db').removesuffix('lufs') )
+
 # calculate compensated peak based on peak and gain tag strings
 def calc_compensated_peak(peak: float, gain_db: str) -> float:
-	db = float( gain_db.lower().removesuffix('db').removesuffix('lufs') )
+	db = parse_gain(gain_db)
 	if db == float('inf'):
 		return 0.
 	else:
 		return peak * db_gain(db)
 
 # generate peak dictionary in either track or album gain mode
-# returns a dict in such form:
+# returns a dict in such form, sorted by the peak value:
 #	track_path: peak_value
 def gen_peak_dict(releases: dict, album_mode: bool = True):
-	track_peaks = {}
-	if album_mode:
-		gain_tag = "replaygain_album_gain"
+	track_paths, peaks = gen_peak_arrays(extract_track_columns(releases), album_mode)
+	return dict(zip(track_paths, peaks.tolist()))
+
+# columnar loudness analytics
+# the track data is extracted into NumPy arrays once (missing values are NaN),
+# and everything else is computed on whole columns
+GAIN_COLUMNS = {
+	"track_gain": "replaygain_track_gain",
+	"album_gain": "replaygain_album_gain"
+}
+PEAK_COLUMNS = {
+	"track_peak": "replaygain_track_peak",
+	"album_peak": "replaygain_album_peak"
+}
+
+# extract track columns from the releases
+# returns a dict with "path" and "release_path" lists, "release" array of indices in "release_path",
+# and track_gain, album_gain, track_peak, album_peak, length, rate and depth float arrays
+# "path" is left empty if track_paths is False (e.g. for statistics, which don't need them)
+def extract_track_columns(releases: dict, track_paths: bool = True) -> dict:
+	paths = []
+	track_counts = []
+	values: dict[str,list[float]] = dict( (column, []) for column in (*GAIN_COLUMNS, *PEAK_COLUMNS, "length", "rate", "depth") )
+	nan = float('nan')
+	for release_path, release in releases.items():
+		track_counts.append(len(release["tracks"]))
+		if track_paths:
+			paths.extend( path.join(release_path, track_name) for track_name in release["tracks"] )
+		for track in release["tracks"].values():
+			tags = track["tags"]
+			for column, tag in GAIN_COLUMNS.items():
+				values[column].append( parse_gain(tags[tag][0]) if tag in tags else nan )
+			for column, tag in PEAK_COLUMNS.items():
+				values[column].append( float(tags[tag][0]) if tag in tags else nan )
+			values["length"].append(track["length"])
+			values["rate"].append(track["rate"])
+			values["depth"].append(track["depth"])
+	return {
+		"path": paths,
+		"release_path": [*releases.keys()],
+		"release": np.repeat(np.arange(len(track_counts), dtype=np.int64), track_counts),
+		**dict( (k, np.array(v, dtype=np.float64)) for k,v in values.items() )
+	}
+
+# calculate compensated track peaks for the whole column in either track or album gain mode
+# same as calc_compensated_peak: infinite gain yields 0, tracks missing the tags yield NaN
+def calc_compensated_peaks(columns: dict, album_mode: bool = True) -> np.ndarray:
+	gain = columns["album_gain"] if album_mode else columns["track_gain"]
+	with np.errstate(over='ignore', invalid='ignore'):
+		return np.where( gain == np.inf, 0., columns["track_peak"] * 10**(gain/20) )
+
+# get the maximum compensated peaks in track and album gain modes
+def calc_max_peaks(columns: dict) -> tuple[float,float]:
+	track_peaks = calc_compensated_peaks(columns, album_mode=False)
+	album_peaks = calc_compensated_peaks(columns, album_mode=True)
+	return (
+		float( np.max(track_peaks[~np.isnan(track_peaks)], initial=0.) ),
+		float( np.max(album_peaks[~np.isnan(album_peaks)], initial=0.) )
+	)
+
+# vectorized gen_peak_dict: compensated peaks sorted in ascending order
+# returns (track_paths, peaks), tracks missing the tags are skipped
+def gen_peak_arrays(columns: dict, album_mode: bool = True) -> tuple[list[str],np.ndarray]:
+	peaks = calc_compensated_peaks(columns, album_mode)
+	order = np.argsort(peaks, kind='stable')
+	order = order[~np.isnan(peaks[order])]
+	return [columns["path"][i] for i in order], peaks[order]
+
+# per-release peak statistics, computed on the columns of all the given releases at once
+# returns the maximum compensated peaks in track and album gain modes and the counts of clipping tracks
+# (over 1.0 in either mode), as lists in the order of the releases
+def calc_release_peak_stats(releases: dict, columns: dict|None = None) -> tuple[list[float],list[float],list[int]]:
+	if columns is None:
+		columns = extract_track_columns(releases, track_paths=False)
+	track_peaks = calc_compensated_peaks(columns, album_mode=False)
+	album_peaks = calc_compensated_peaks(columns, album_mode=True)
+	release_count = len(columns["release_path"])
+	# fmax skips NaN, so tracks missing the tags don't count
+	max_track_peaks = np.zeros(release_count)
+	np.fmax.at(max_track_peaks, columns["release"], track_peaks)
+	max_album_peaks = np.zeros(release_count)
+	np.fmax.at(max_album_peaks, columns["release"], album_peaks)
+	with np.errstate(invalid='ignore'):
+		clipping = (track_peaks > 1.0) | (album_peaks > 1.0)
+	clipping_counts = np.bincount(columns["release"], weights=clipping, minlength=release_count).astype(np.int64)
+	return max_track_peaks.tolist(), max_album_peaks.tolist(), clipping_counts.tolist()
+
+# find tracks which clip (compensated peak over 1.0) in track and album gain modes
+# returns (clipping_in_track_mode, clipping_in_album_mode) lists of track paths
+def find_clipping_tracks(releases: dict, columns: dict|None = None) -> tuple[list[str],list[str]]:
+	if columns is None:
+		columns = extract_track_columns(releases)
+	clipping = []
+	for album_mode in (False, True):
+		with np.errstate(invalid='ignore'):
+			indices = np.flatnonzero( calc_compensated_peaks(columns, album_mode) > 1.0 )
+		clipping.append([columns["path"][i] for i in indices])
+	return clipping[0], clipping[1]
+
+# target loudness analysis
+# ReplayGain gains bring tracks to the reference loudness, so at the target loudness L the applied gain
+# is gain + L - reference, and the track clips if peak * db_gain(gain + L - reference) > 1.0, that is
+# if L exceeds the track threshold: reference - 20*log10(peak) - gain
+# the fraction of clipping tracks at L is thus the fraction of thresholds below L
+REPLAYGAIN_REFERENCE_LOUDNESS = -18.
+CANDIDATE_LOUDNESS = tuple( float(l) for l in range(-14, -24, -1) )
+
+# calculate clipping thresholds for tracks (in track gain mode) and albums (in album gain mode)
+# returns (track_thresholds, album_thresholds), NaN where the tags are missing
+def calc_clipping_thresholds(columns: dict) -> tuple[np.ndarray,np.ndarray]:
+	thresholds = []
+	for gain in (columns["track_gain"], columns["album_gain"]):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			threshold = REPLAYGAIN_REFERENCE_LOUDNESS - 20*np.log10(columns["track_peak"]) - gain
+		# infinite gain means silence, which never clips
+		thresholds.append( np.where(gain == np.inf, np.inf, threshold) )
+	# an album clips as soon as any of its tracks does
+	album_thresholds = np.full(len(columns["release_path"]), np.nan)
+	np.fmin.at(album_thresholds, columns["release"], thresholds[1])
+	return thresholds[0], album_thresholds
+
+# exact clipping fractions for the given candidate target loudness values
+def calc_clipping_fractions(thresholds: np.ndarray, candidates: Iterable[float] = CANDIDATE_LOUDNESS) -> dict[float,float]:
+	thresholds = np.sort(thresholds[~np.isnan(thresholds)])
+	if len(thresholds) == 0:
+		return dict( (candidate, 0.) for candidate in candidates )
+	return dict(
+			(candidate, int(np.searchsorted(thresholds, candidate, side='left'))/len(thresholds))
+			for candidate in candidates
+	)
+
+# exact maximum target loudness at which at least the given fraction of thresholds doesn't clip
+def find_target_loudness(thresholds: np.ndarray, fit: float = 0.95) -> float:
+	thresholds = np.sort(thresholds[~np.isnan(thresholds)])
+	if len(thresholds) == 0:
+		return float('inf')
+	return float( thresholds[min( int((1-fit)*len(thresholds)), len(thresholds)-1 )] )
+
+# approximate threshold distribution with fixed-width bins
+# it can be updated incrementally (e.g. with the releases changed by update_db) and merged,
+# and its fractions and target loudness are accurate to a single bin width
+class LoudnessHistogram:
+	def __init__(self, low: float = -80., high: float = 40., bin_width: float = 0.01):
+		self.low = low
+		self.bin_width = bin_width
+		# the first and the last bins hold everything below and above the range
+		self.counts = np.zeros( int(round((high-low)/bin_width))+2, dtype=np.int64 )
+
+	def _bins(self, thresholds: np.ndarray) -> np.ndarray:
+		thresholds = thresholds[~np.isnan(thresholds)]
+		with np.errstate(invalid='ignore'):
+			bins = np.floor( (thresholds-self.low)/self.bin_width ) + 1
+		return np.clip( np.nan_to_num(bins, nan=0, posinf=len(self.counts)-1, neginf=0), 0, len(self.counts)-1 ).astype(np.int64)
+
+	def add(self, thresholds: np.ndarray, sign: int = 1):
+		np.add.at(self.counts, self._bins(thresholds), sign)
+
+	def remove(self, thresholds: np.ndarray):
+		self.add(thresholds, -1)
+
+	def merge(self, other: 'LoudnessHistogram'):
+		self.counts += other.counts
+
+	def total(self) -> int:
+		return int(self.counts.sum())
+
+	def clipping_fractions(self, candidates: Iterable[float] = CANDIDATE_LOUDNESS) -> dict[float,float]:
+		total = self.total()
+		cumulative = np.cumsum(self.counts)
+		fractions = {}
+		for candidate in candidates:
+			bin_number = int(self._bins(np.array([candidate]))[0])
+			fractions[candidate] = int(cumulative[bin_number-1])/total if total > 0 and bin_number > 0 else 0.
+		return fractions
+
+	def target_loudness(self, fit: float = 0.95) -> float:
+		total = self.total()
+		if total == 0:
+			return float('inf')
+		bin_number = int( np.searchsorted(np.cumsum(self.counts), int((1-fit)*total), side='right') )
+		return self.low + (bin_number-1)*self.bin_width
+
+# build track and album histograms for the given releases
+def calc_loudness_histograms(releases: dict, columns: dict|None = None) -> dict[str,LoudnessHistogram]:
+	if columns is None:
+		columns = extract_track_columns(releases)
+	histograms = {"tracks": LoudnessHistogram(), "albums": LoudnessHistogram()}
+	for histogram, thresholds in zip(histograms.values(), calc_clipping_thresholds(columns)):
+		histogram.add(thresholds)
+	return histograms
+
+# analyze the fractions of clipping tracks and albums at candidate target loudness values
+# in either "exact" or "approximate" (histogram) mode
+# returns {"tracks": {loudness: fraction}, "albums": {loudness: fraction}, "target": {"tracks": float, "albums": float}}
+def analyze_target_loudness(
+			releases: dict,
+			candidates: Iterable[float] = CANDIDATE_LOUDNESS,
+			fit: float = 0.95,
+			mode: str = 'exact',
+			columns: dict|None = None,
+			histograms: dict[str,LoudnessHistogram]|None = None
+	) -> dict:
+	candidates = list(candidates)
+	if mode == 'approximate':
+		if histograms is None:
+			histograms = calc_loudness_histograms(releases, columns)
+		return {
+			"tracks": histograms["tracks"].clipping_fractions(candidates),
+			"albums": histograms["albums"].clipping_fractions(candidates),
+			"target": dict( (k, h.target_loudness(fit)) for k,h in histograms.items() )
+		}
+	elif mode == 'exact':
+		if columns is None:
+			columns = extract_track_columns(releases)
+		track_thresholds, album_thresholds = calc_clipping_thresholds(columns)
+		return {
+			"tracks": calc_clipping_fractions(track_thresholds, candidates),
+			"albums": calc_clipping_fractions(album_thresholds, candidates),
+			"target": {
+				"tracks": find_target_loudness(track_thresholds, fit),
+				"albums": find_target_loudness(album_thresholds, fit)
+			}
+		}
 	else:
-		gain_tag = "replaygain_track_gain"
-	for release_path, value in releases.items():
-		for track_name, track in value["tracks"].items():
-			if ( "replaygain_track_peak" in track["tags"].keys()
-					and gain_tag in track["tags"].keys() ):
-				peak = calc_compensated_peak(
-						float(track["tags"]["replaygain_album_peak"][0]),
-						track["tags"][gain_tag][0]
+		raise Exception(f"Unknown loudness analysis mode: '{mode}'.")
+
+# gain analysis of the tracks lacking ReplayGain data
+# the computed values are stored as ReplayGain 2.0 tags in the track blobs (so every report uses them),
+# and the names of the computed tags are listed in the track "computed_gain" field
+# the blob tags are replaced on the next rescan of the track, so with trust_mtime=False
+# the computed values are kept only if they were also written into the files
+TRACK_GAIN_TAGS = ("replaygain_track_gain", "replaygain_track_peak")
+ALBUM_GAIN_TAGS = ("replaygain_album_gain", "replaygain_album_peak")
+
+def lacks_track_gain(tags: dict) -> bool:
+	return "r128_track_gain" not in tags and any( tag not in tags for tag in TRACK_GAIN_TAGS )
+
+def lacks_album_gain(tags: dict) -> bool:
+	return "r128_album_gain" not in tags and any( tag not in tags for tag in ALBUM_GAIN_TAGS )
+
+# find the releases that need the gain analysis
+# returns a dict in such form:
+#	release_path: {"tracks": [track names lacking track gain], "album": whether album gain is lacking}
+def find_missing_gain(releases: dict) -> dict[str,dict]:
+	found = {}
+	for release_path, release in releases.items():
+		tracks = [ track_name for track_name, track in release["tracks"].items() if lacks_track_gain(track["tags"]) ]
+		album = any( lacks_album_gain(track["tags"]) for track in release["tracks"].values() )
+		if len(tracks) > 0 or album:
+			found[release_path] = {"tracks": tracks, "album": album}
+	return found
+
+# analyze a single release, it's run in the worker processes of analyze_gain
+# returns {track_name: {tag: [value]}} with the tags to be set
+def analyze_release_gain(
+			release_path: str,
+			track_names: list[str],
+			lacking_tracks: list[str],
+			album: bool,
+			write_tags: bool = False,
+			ffmpeg_path: str|None = None
+	) -> dict[str,dict[str,list[str]]]:
+	results = dict( (track_name, {}) for track_name in track_names )
+	track_paths = [ path.join(release_path, track_name) for track_name in track_names ]
+	track_data = {}
+	for track_name in lacking_tracks:
+		loudness, peak = r128gain.get_r128_loudness(
+				(path.join(release_path, track_name),),
+				enable_ffmpeg_threading=False,
+				ffmpeg_path=ffmpeg_path
+		)
+		track_data[track_name] = (loudness, peak)
+		results[track_name]["replaygain_track_gain"] = [f"{REPLAYGAIN_REFERENCE_LOUDNESS - loudness:.2f} dB"]
+		results[track_name]["replaygain_track_peak"] = [f"{peak:.6f}"]
+	album_loudness = album_peak = None
+	if album:
+		# the tracks are concatenated in the tracklist order, like r128gain does
+		album_loudness, album_peak = r128gain.get_r128_loudness(
+				natsorted(track_paths),
+				enable_ffmpeg_threading=False,
+				ffmpeg_path=ffmpeg_path
+		)
+		for track_name in track_names:
+			results[track_name]["replaygain_album_gain"] = [f"{REPLAYGAIN_REFERENCE_LOUDNESS - album_loudness:.2f} dB"]
+			results[track_name]["replaygain_album_peak"] = [f"{album_peak:.6f}"]
+	if write_tags:
+		for track_name in track_names:
+			loudness, peak = track_data.get(track_name, (None, None))
+			if loudness is not None or album_loudness is not None:
+				r128gain.tag(
+						path.join(release_path, track_name),
+						loudness,
+						peak,
+						album_loudness=album_loudness,
+						album_peak=album_peak
 				)
-				track_peaks[path.join(release_path,track_name)] = peak
-	return dict(sorted(track_peaks.items(), key=lambda x:x[1]))
+	return dict( (k,v) for k,v in results.items() if len(v) > 0 )
 
-# calculate statistics for the given database
-def calc_stats(releases: dict,
-				critical_tags: list[str] = [],
-				wanted_tags: list[str] = []) -> dict:
-	statistics = {
+# store the analysis results of a release in its track blobs
+def apply_release_gain(release: dict, results: dict[str,dict[str,list[str]]]):
+	for track_name, tags in results.items():
+		track = release["tracks"][track_name]
+		computed = track.setdefault("computed_gain", [])
+		for tag, value in tags.items():
+			if tag in track["tags"] and tag not in computed:
+				continue
+			track["tags"][tag] = value
+			if tag not in computed:
+				computed.append(tag)
+		track["tags"] = dict( natsorted(track["tags"].items()) )
+		if len(computed) == 0:
+			track.pop("computed_gain")
+
+# analyze the gain of all the tracks and albums lacking it in a process pool
+# every release is a single job (track gains and the album gain over all of its tracks),
+# results are stored as soon as a release is done and logged to the journal if one is given,
+# so an interrupted run can be resumed by loading the database and running it again
+# no new releases are started after time_budget seconds
+# the statistics and the tag index of the database are updated for the analyzed releases
+# returns a dict in such form:
+#	analyzed: [release_paths], failed: {release_path: error}, remaining: [release_paths]
+def analyze_gain(
+			db: dict,
+			workers: int = 1,
+			write_tags: bool = False,
+			time_budget: float|None = None,
+			ffmpeg_path: str|None = None,
+			callback: Callable = lambda **d: None,
+			journal: Journal|None = None
+	) -> dict:
+	if journal is None:
+		journal = Journal()
+	start = time()
+	missing = find_missing_gain(db["releases"])
+	pending = iter(missing.items())
+	report = {"analyzed": [], "failed": {}, "remaining": []}
+	old_statistics = {}
+	with ProcessPoolExecutor(max(1, workers)) as executor:
+		futures = {}
+		# keep only a couple of jobs queued, so that the budget stops the run quickly
+		def submit_next():
+			if time_budget is not None and time()-start >= time_budget:
+				return False
+			for release_path, lacking in pending:
+				futures[executor.submit(
+						analyze_release_gain,
+						release_path,
+						[*db["releases"][release_path]["tracks"].keys()],
+						lacking["tracks"],
+						lacking["album"],
+						write_tags,
+						ffmpeg_path
+				)] = release_path
+				return True
+			return False
+		while len(futures) < 2*max(1, workers) and submit_next():
+			pass
+		while len(futures) > 0:
+			done, _ = wait(futures, return_when=FIRST_COMPLETED)
+			for future in done:
+				release_path = futures.pop(future)
+				try:
+					results = future.result()
+				except Exception as e:
+					report["failed"][release_path] = str(e)
+				else:
+					release = db["releases"][release_path]
+					if "statistics" in release:
+						old_statistics[release_path] = release["statistics"]
+					apply_release_gain(release, results)
+					for track_name in results.keys():
+						track = release["tracks"][track_name]
+						journal.set(release, release_path, "tags", track["tags"], "tracks", track_name)
+						if "computed_gain" in track:
+							journal.set(release, release_path, "computed_gain", track["computed_gain"], "tracks", track_name)
+					report["analyzed"].append(release_path)
+				callback(
+						operation="analyzing gain",
+						release=release_path,
+						release_count=len(missing),
+						analyzed_releases=len(report["analyzed"])+len(report["failed"])
+				)
+				submit_next()
+		report["remaining"] = [ release_path for release_path, _ in pending ]
+	# keep the derived data consistent with the new tags
+	if "tag_index" in db:
+		for release_path in report["analyzed"]:
+			remove_from_tag_index(db["tag_index"], release_path)
+			add_to_tag_index(db["tag_index"], release_path, db["releases"][release_path])
+	if len(report["analyzed"]) > 0 and "statistics" in db:
+		if "statistics_state" in db and len(old_statistics) == len(report["analyzed"]):
+			db["statistics"] = update_stats(
+					db["statistics"],
+					db["releases"],
+					[ {"statistics": statistics} for statistics in old_statistics.values() ],
+					report["analyzed"],
+					db["statistics_state"]["critical_tags"],
+					db["statistics_state"]["wanted_tags"]
+			)
+		else:
+			# the stored statistics can't be updated, so make update_db recalculate them
+			db.pop("statistics_state", None)
+	return report
+
+# statistics structure without any data
+def empty_stats() -> dict:
+	return {
 		"max_track_peak": 0.0,
 		"max_album_peak": 0.0,
 		"total_length": 0.0,
@@ -414,69 +1603,54 @@ def calc_stats(releases: dict,
 		}
 	}
 
-	for release in releases.values():
-		# add release track count to total track count
-		statistics["track_counts"]["total"] += len(release["tracks"])
-		for track_name, track in release["tracks"].items():
-			# add track length to total length
-			statistics["total_length"] += track["length"]
-			# init variables
-			tags = track["tags"]
-			album_peak = 0.
-			track_peak = 0.
-			# get peak values, compensate them for gain and save the max value
-			if ( "replaygain_track_peak" in tags.keys()
-					and "replaygain_track_gain" in tags.keys() ):
-				track_peak = calc_compensated_peak(
-						float(track["tags"]["replaygain_track_peak"][0]),
-						track["tags"]["replaygain_track_gain"][0]
-				)
-				statistics["max_track_peak"] = max( track_peak, statistics["max_track_peak"] )
-			if ( "replaygain_album_peak" in tags.keys()
-					and "replaygain_album_gain" in tags.keys() ):
-				album_peak = calc_compensated_peak(
-						float(track["tags"]["replaygain_track_peak"][0]),
-						track["tags"]["replaygain_album_gain"][0]
-				)
-				statistics["max_album_peak"] = max( album_peak, statistics["max_album_peak"] )
-			# classify track as clipping if peak over 1
-			statistics["track_counts"]["clipping"] += (track_peak > 1.0) or (album_peak > 1.0)
-			# classify track as uploaded if IDs exist
-			if "id_orig" in track.keys():
-				statistics["track_counts"]["uploaded_orig"] += 1
-			if "id_opus" in track.keys():
-				statistics["track_counts"]["uploaded_opus"] += 1
-			# classify track by extension
-			ext = path.splitext(track_name)[1].lower()
-			if ext in statistics["track_counts"]["extension"].keys():
-				statistics["track_counts"]["extension"][ext] += 1
-			else:
-				statistics["track_counts"]["extension"][ext] = 1
-			# classify track by bit depth
-			if track["depth"] in statistics["track_counts"]["depth"].keys():
-				statistics["track_counts"]["depth"][track["depth"]] += 1
-			else:
-				statistics["track_counts"]["depth"][track["depth"]] = 1
-			# classify track by sampling rate
-			if track["rate"] in statistics["track_counts"]["rate"].keys():
-				statistics["track_counts"]["rate"][track["rate"]] += 1
-			else:
-				statistics["track_counts"]["rate"][track["rate"]] = 1
-			# classify track by lacking tags
-			missing_critical = any( data not in tags.keys() for data in critical_tags )
-			missing_wanted = any( data not in tags.keys() for data in wanted_tags )
-			statistics["track_counts"]["lacking_tags"]["critical"]	+= missing_critical
-			statistics["track_counts"]["lacking_tags"]["wanted"]	+= missing_wanted
-			statistics["track_counts"]["lacking_tags"]["both"]		+= missing_wanted and missing_critical
-			# classify tracks by the presence of artworks
-			embedded = track["embedded_image"]
-			external = "images" in release
-			statistics["track_counts"]["artwork"]["embedded"]	+= embedded
-			statistics["track_counts"]["artwork"]["external"]	+= external
-			statistics["track_counts"]["artwork"]["both"]		+= embedded and external
-	# convert depth and rate keys to str
-	statistics["track_counts"]["depth"] = {str(k):v for k,v in statistics["track_counts"]["depth"].items()}
-	statistics["track_counts"]["rate"] = {str(k):v for k,v in statistics["track_counts"]["rate"].items()}
+# calculate the statistics contribution of a single release
+# upload counts change without rescanning, so they are left at 0 here and counted by count_uploaded
+# peak_stats is the (max_track_peak, max_album_peak, clipping) of the release from calc_release_peak_stats,
+# calculated here if not given
+def calc_release_stats(release: dict,
+				critical_tags: list[str] = [],
+				wanted_tags: list[str] = [],
+				peak_stats: tuple[float,float,int]|None = None) -> dict:
+	statistics = empty_stats()
+	# add release track count to total track count
+	statistics["track_counts"]["total"] += len(release["tracks"])
+	# compensated peaks and clipping tracks
+	if peak_stats is None:
+		peak_stats = tuple( column[0] for column in calc_release_peak_stats({"": release}) )
+	statistics["max_track_peak"], statistics["max_album_peak"], clipping = peak_stats
+	statistics["track_counts"]["clipping"] += clipping
+	for track_name, track in release["tracks"].items():
+		tags = track["tags"]
+		# classify track by extension
+		ext = path.splitext(track_name)[1].lower()
+		if ext in statistics["track_counts"]["extension"].keys():
+			statistics["track_counts"]["extension"][ext] += 1
+		else:
+			statistics["track_counts"]["extension"][ext] = 1
+		# classify track by bit depth
+		if str(track["depth"]) in statistics["track_counts"]["depth"].keys():
+			statistics["track_counts"]["depth"][str(track["depth"])] += 1
+		else:
+			statistics["track_counts"]["depth"][str(track["depth"])] = 1
+		# classify track by sampling rate
+		if str(track["rate"]) in statistics["track_counts"]["rate"].keys():
+			statistics["track_counts"]["rate"][str(track["rate"])] += 1
+		else:
+			statistics["track_counts"]["rate"][str(track["rate"])] = 1
+		# classify track by lacking tags
+		missing_critical = any( data not in tags.keys() for data in critical_tags )
+		missing_wanted = any( data not in tags.keys() for data in wanted_tags )
+		statistics["track_counts"]["lacking_tags"]["critical"]	+= missing_critical
+		statistics["track_counts"]["lacking_tags"]["wanted"]	+= missing_wanted
+		statistics["track_counts"]["lacking_tags"]["both"]		+= missing_wanted and missing_critical
+		# classify tracks by the presence of artworks
+		embedded = track["embedded_image"]
+		external = "images" in release
+		statistics["track_counts"]["artwork"]["embedded"]	+= embedded
+		statistics["track_counts"]["artwork"]["external"]	+= external
+		statistics["track_counts"]["artwork"]["both"]		+= embedded and external
+	# track length is summed exactly, so that the sum over releases doesn't depend on their order
+	statistics["total_length"] = fsum( track["length"] for track in release["tracks"].values() )
 
 	# at this point, "embedded" has the count of all tracks with embedded images,
 	# but it would be more useful if it only counted the ones ONLY with embedded images, but not with both.
@@ -488,6 +1662,80 @@ def calc_stats(releases: dict,
 
 	return statistics
 
+# add (or subtract, if sign is -1) the track counts of a release contribution to the total ones
+# empty extension/depth/rate buckets are removed, as they are never present in a full recompute
+def merge_track_counts(total: dict, contribution: dict, sign: int = 1):
+	for key, value in contribution.items():
+		if isinstance(value, dict):
+			merge_track_counts(total.setdefault(key, {}), value, sign)
+			if key in ("extension","depth","rate"):
+				for bucket in [k for k,v in total[key].items() if v == 0]:
+					total[key].pop(bucket)
+		else:
+			total[key] = total.get(key, 0) + sign*value
+
+# calculate the values which are not additive (maximums and floating point sums)
+# from the stored release contributions and count uploaded tracks
+def finalize_stats(statistics: dict, releases: dict):
+	contributions = [release["statistics"] for release in releases.values()]
+	statistics["max_track_peak"] = max( (c["max_track_peak"] for c in contributions), default=0.0 )
+	statistics["max_album_peak"] = max( (c["max_album_peak"] for c in contributions), default=0.0 )
+	statistics["total_length"] = fsum( c["total_length"] for c in contributions )
+	count_uploaded(statistics, releases)
+
+# classify tracks as uploaded if IDs exist
+def count_uploaded(statistics: dict, releases: dict):
+	statistics["track_counts"]["uploaded_orig"] = 0
+	statistics["track_counts"]["uploaded_opus"] = 0
+	for release in releases.values():
+		for track in release["tracks"].values():
+			statistics["track_counts"]["uploaded_orig"] += "id_orig" in track
+			statistics["track_counts"]["uploaded_opus"] += "id_opus" in track
+
+# calculate statistics for the given database
+# per-release contributions are saved into the releases as "statistics" for update_stats
+def calc_stats(releases: dict,
+				critical_tags: list[str] = [],
+				wanted_tags: list[str] = []) -> dict:
+	statistics = empty_stats()
+	for release, *peak_stats in zip(releases.values(), *calc_release_peak_stats(releases)):
+		release["statistics"] = calc_release_stats(release, critical_tags, wanted_tags, peak_stats)
+		merge_track_counts(statistics["track_counts"], release["statistics"]["track_counts"])
+	finalize_stats(statistics, releases)
+	return statistics
+
+# incrementally update the statistics
+# removed_releases are the old versions of deleted and modified releases (with their stored contributions),
+# added_releases are the paths of new and modified releases in "releases"
+def update_stats(statistics: dict,
+				releases: dict,
+				removed_releases: Iterable[dict],
+				added_releases: Iterable[str],
+				critical_tags: list[str] = [],
+				wanted_tags: list[str] = []) -> dict:
+	statistics = deepcopy(statistics)
+	for release in removed_releases:
+		merge_track_counts(statistics["track_counts"], release["statistics"]["track_counts"], -1)
+	added = dict( (release_path, releases[release_path]) for release_path in added_releases )
+	for release, *peak_stats in zip(added.values(), *calc_release_peak_stats(added)):
+		release["statistics"] = calc_release_stats(release, critical_tags, wanted_tags, peak_stats)
+		merge_track_counts(statistics["track_counts"], release["statistics"]["track_counts"])
+	finalize_stats(statistics, releases)
+	return statistics
+
+# check that the stored statistics are equal to the fully recomputed ones
+# the stored release contributions are not modified
+def verify_stats(db: dict, critical_tags: list[str] = [], wanted_tags: list[str] = []) -> bool:
+	statistics = empty_stats()
+	contributions = {}
+	for (release_path, release), *peak_stats in zip(db["releases"].items(), *calc_release_peak_stats(db["releases"])):
+		contributions[release_path] = {"tracks": release["tracks"], "statistics": calc_release_stats(release, critical_tags, wanted_tags, peak_stats)}
+		if release.get("statistics") != contributions[release_path]["statistics"]:
+			return False
+		merge_track_counts(statistics["track_counts"], contributions[release_path]["statistics"]["track_counts"])
+	finalize_stats(statistics, contributions)
+	return statistics == db["statistics"]
+
 # get the list of not yet uploaded releases
 def get_not_uploaded_releases(releases: dict) -> dict[str,dict[str,list|str|None]]:
 	# init return blob
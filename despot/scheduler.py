@@ -0,0 +1,264 @@
+import asyncio
+import inspect
+import os
+from collections import Counter, deque
+from functools import partial
+from typing import Callable
+from pyrogram.errors import FloodWait
+import pyrogram.types
+
+# rate-limit-aware wrapper around the pyrogram client (or anything with the same async methods)
+# every async method of the client is called through ClientScheduler.call, which:
+# * waits for the per-method budget, e.g. { 'send_audio': (20, 60) } allows 20 calls per 60 seconds
+# * waits out FloodWait errors, with the wait multiplied by backoff on every retry of the same call
+# * counts the calls per method (calls) and the time spent waiting (waited)
+# caption edits can be coalesced with schedule_caption: only the latest caption of a message is sent,
+# at most once per flush_interval seconds and on flush_captions
+class ClientScheduler:
+	def __init__(
+			self,
+			client,
+			budgets: dict[str,tuple[int,float]]|None = None,
+			flush_interval: float = 10.,
+			max_retries: int = 5,
+			backoff: float = 1.5
+		):
+		self.client = client
+		self.budgets = budgets or {}
+		self.flush_interval = flush_interval
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.calls = Counter()
+		self.waited = 0.
+		self._history: dict[str,deque] = {}
+		self._resume_at = 0.
+		# (chat_id, message_id) -> caption renderer
+		self._pending: dict[tuple,Callable[[],str]] = {}
+		self._sent_captions: dict[tuple,str] = {}
+		self._flush_task: asyncio.Task|None = None
+		self._flush_error: Exception|None = None
+		self._flush_lock = asyncio.Lock()
+
+	def __getattr__(self, name: str):
+		attr = getattr(self.client, name)
+		# pyrogram wraps its async methods with async_to_sync, which hides them from iscoroutinefunction,
+		# but the wrapper keeps the original in __wrapped__
+		if inspect.iscoroutinefunction(inspect.unwrap(attr)):
+			return partial(self.call, name)
+		return attr
+
+	async def _sleep(self, delay: float):
+		if delay > 0:
+			self.waited += delay
+			await asyncio.sleep(delay)
+
+	# wait until both the flood wait and the method budget allow the call
+	async def _acquire(self, method: str):
+		loop = asyncio.get_running_loop()
+		while True:
+			now = loop.time()
+			if now < self._resume_at:
+				await self._sleep(self._resume_at - now)
+				continue
+			if method not in self.budgets:
+				return
+			limit, period = self.budgets[method]
+			history = self._history.setdefault(method, deque())
+			while history and history[0] <= now - period:
+				history.popleft()
+			if len(history) < limit:
+				history.append(now)
+				return
+			await self._sleep(history[0] + period - now)
+
+	async def call(self, method: str, *args, **kwargs):
+		loop = asyncio.get_running_loop()
+		for attempt in range(self.max_retries+1):
+			await self._acquire(method)
+			self.calls[method] += 1
+			try:
+				return await getattr(self.client, method)(*args, **kwargs)
+			except FloodWait as e:
+				if attempt == self.max_retries:
+					raise
+				# the flood wait applies to the whole account, so all calls wait for it
+				self._resume_at = max(self._resume_at, loop.time() + e.value*self.backoff**attempt)
+
+	# replace the pending caption of the message, render is called when the edit is sent
+	def schedule_caption(self, chat_id: int|str, message_id: int, render: Callable[[],str]):
+		if self._flush_error is not None:
+			error, self._flush_error = self._flush_error, None
+			raise error
+		self._pending[(chat_id, message_id)] = render
+		if self._flush_task is None or self._flush_task.done():
+			self._flush_task = asyncio.create_task(self._flush_later())
+
+	async def _flush_later(self):
+		await asyncio.sleep(self.flush_interval)
+		try:
+			async with self._flush_lock:
+				await self._flush()
+		except Exception as e:
+			self._flush_error = e
+
+	async def _flush(self, chat_id: int|str|None = None, message_id: int|None = None):
+		for key in [*self._pending]:
+			if (chat_id is not None and key[0] != chat_id) or (message_id is not None and key[1] != message_id):
+				continue
+			render = self._pending.pop(key, None)
+			if render is None:
+				continue
+			caption = render()
+			# telegram rejects edits that don't change the message
+			if self._sent_captions.get(key) == caption:
+				continue
+			msg = await self.call('edit_message_caption', key[0], key[1], caption)
+			if not isinstance(msg, pyrogram.types.Message):
+				raise Exception('Message edit error.', f'Could not update the release message with new info. Message id: {key[1]}')
+			self._sent_captions[key] = caption
+
+	# send the pending captions now (all of them, or only of the given chat/message)
+	# the timed flush is cancelled once no captions are pending, even if sending failed,
+	# so a finished or failed upload doesn't leave it behind
+	async def flush_captions(self, chat_id: int|str|None = None, message_id: int|None = None):
+		flush_task = None
+		async with self._flush_lock:
+			try:
+				if self._flush_error is not None:
+					error, self._flush_error = self._flush_error, None
+					raise error
+				await self._flush(chat_id, message_id)
+			finally:
+				# the timed flush can't be sending while the lock is held
+				if len(self._pending) == 0 and self._flush_task is not None:
+					flush_task, self._flush_task = self._flush_task, None
+					flush_task.cancel()
+		if flush_task is not None:
+			await asyncio.gather(flush_task, return_exceptions=True)
+
+# maximum amount of messages deleted by a single request
+DELETE_BATCH_SIZE = 100
+
+# upload statistics of a pool member
+class PoolMember:
+	def __init__(self, client: ClientScheduler):
+		self.client = client
+		self.busy = False
+		self.sent_bytes = 0
+		self.sent_tracks = 0
+		self.busy_time = 0.
+		# ids of the messages uploaded into the staging chat, copied into the target chats or not
+		self.staged: list[int] = []
+
+	# upload speed in bytes per second (infinite until measured, so that every member gets tried)
+	def throughput(self) -> float:
+		return self.sent_bytes/self.busy_time if self.busy_time > 0 else float('inf')
+
+def audio_size(audio) -> int:
+	if isinstance(audio, str):
+		return os.path.getsize(audio)
+	if hasattr(audio, 'getbuffer'):
+		return audio.getbuffer().nbytes
+	return 0
+
+# several authorized sessions uploading tracks in parallel
+# every member uploads one track at a time, the next track goes to the fastest idle member
+# members upload the audio into staging_chat, which every session can access, and the primary client
+# (a member or not) copies the staged messages into the target chat in the order of the send_audio calls,
+# so concurrently sent tracks keep their order in the channel
+# every other method is called through the primary client, like in ClientScheduler
+class ClientPool(ClientScheduler):
+	def __init__(
+			self,
+			client,
+			members: list,
+			staging_chat: int|str,
+			**scheduler_settings
+		):
+		super().__init__(client, **scheduler_settings)
+		self.members = [
+			PoolMember(member if isinstance(member, ClientScheduler) else ClientScheduler(member, **scheduler_settings))
+			for member in members
+		]
+		if len(self.members) == 0:
+			raise Exception('The client pool needs at least one member.')
+		self.staging_chat = staging_chat
+		# per target chat: the next ticket to give out, the ticket allowed to be copied and the failed ticket
+		self._issued: dict = {}
+		self._turn: dict = {}
+		self._failed: dict = {}
+		self._turn_changed = asyncio.Condition()
+		self._member_freed = asyncio.Condition()
+
+	# amount of tracks worth sending at once
+	@property
+	def concurrency(self) -> int:
+		return len(self.members)
+
+	async def _acquire_member(self) -> PoolMember:
+		async with self._member_freed:
+			await self._member_freed.wait_for(lambda: any(not member.busy for member in self.members))
+			member = max((member for member in self.members if not member.busy), key=PoolMember.throughput)
+			member.busy = True
+			return member
+
+	async def _release_member(self, member: PoolMember):
+		async with self._member_freed:
+			member.busy = False
+			self._member_freed.notify_all()
+
+	async def send_audio(self, chat_id: int|str, audio, **kwargs):
+		# the ticket is taken before the first await, so the order of the calls is the order in the chat
+		if self._issued.get(chat_id, 0) == self._turn.get(chat_id, 0):
+			self._failed.pop(chat_id, None)
+		ticket = self._issued.get(chat_id, 0)
+		self._issued[chat_id] = ticket+1
+		self._turn.setdefault(chat_id, 0)
+		loop = asyncio.get_running_loop()
+		size = audio_size(audio)
+		try:
+			member = await self._acquire_member()
+			try:
+				start = loop.time()
+				staged = await member.client.send_audio(self.staging_chat, audio, **kwargs)
+				if not isinstance(staged, pyrogram.types.Message):
+					raise Exception(f'Could not upload the track to the staging chat {self.staging_chat}.')
+				# recorded right away, so that the tracks which are never copied get cleaned up too
+				member.staged.append(staged.id)
+				member.busy_time += loop.time() - start
+				member.sent_bytes += size
+				member.sent_tracks += 1
+			finally:
+				await self._release_member(member)
+			async with self._turn_changed:
+				await self._turn_changed.wait_for(lambda: self._turn[chat_id] == ticket)
+			# the tracks after a failed one are not copied, as that would break the order
+			if self._failed.get(chat_id, ticket) < ticket:
+				raise Exception(f'Track #{self._failed[chat_id]} of this chat failed to upload.')
+			return await self.call('copy_message', chat_id, self.staging_chat, staged.id)
+		except BaseException:
+			if self._failed.get(chat_id, ticket) >= ticket:
+				self._failed[chat_id] = ticket
+			raise
+		finally:
+			# wait for the turn even on failure, so that the later tickets are released in order
+			async with self._turn_changed:
+				if self._turn[chat_id] < ticket:
+					await self._turn_changed.wait_for(lambda: self._turn[chat_id] >= ticket)
+				self._turn[chat_id] = ticket+1
+				self._turn_changed.notify_all()
+
+	# delete the messages uploaded into the staging chat, including the ones of failed sends
+	async def clean_staging(self):
+		for member in self.members:
+			while len(member.staged) > 0:
+				batch = member.staged[:DELETE_BATCH_SIZE]
+				await member.client.delete_messages(self.staging_chat, batch)
+				del member.staged[:len(batch)]
+
+	# (sent bytes, busy seconds, bytes per second, sent tracks) for every member
+	def throughput(self) -> list[tuple[int,float,float,int]]:
+		return [
+			(member.sent_bytes, member.busy_time, member.sent_bytes/member.busy_time if member.busy_time > 0 else 0., member.sent_tracks)
+			for member in self.members
+		]
@@ -1,11 +1,23 @@
-from typing import Literal
+from typing import BinaryIO, Literal
 from library import *
+from scheduler import ClientScheduler, ClientPool, DELETE_BATCH_SIZE
+import asyncio
+import hashlib
+import io
+import json
+import os
 import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from functools import lru_cache
 from icu._icu_ import Transliterator
 import subprocess
 from enum import Enum
 from shutil import copyfile
+from uuid import uuid4
 from r128gain.opusgain import \
+	parse_oggopus_output_gain as parse_opus_gain, \
 	write_oggopus_output_gain as write_opus_gain
 from r128gain import float_to_q7dot8
 import mutagen.oggopus as mutagen_opus
@@ -42,42 +54,67 @@ R128_TAGLIST = ( 'r128_track_gain', 'r128_album_gain')
 MP3GAIN_TAGLIST = ( 'mp3gain_minmax', 'mp3gain_album_minmax', 'mp3gain_undo')
 
 # format the user-defined release format string with the appropriate data
-def format_release_string(release_string: str, release: dict, channel_type: Literal['opus','orig'], track_separator: str = '. ') -> str:
-	link_field = 'link_'+channel_type
-	# init transliterator
-	to_latin = Transliterator.createInstance("Any-Latin")
-	# init other formatting data (subject to expansion)
-	formatting_data = {
-		'album': get_tag_fom_first_track(release, 'album'),
-		'albumartist': get_tag_fom_first_track(release, 'albumartist'),
-		'date': get_tag_fom_first_track(release, 'date'),
-		'totaltracks': get_tag_fom_first_track(release, 'totaltracks'),
-		'depth_rates': set(f'{track["depth"]}/{int(track["rate"])/1000}' for track in release["tracks"].values() )
-	}
-	formatting_data['depth_rates'] = ', '.join(formatting_data['depth_rates'])
-	latin_tracklist = ""
-	# stack up tracklist
-	for track in release["tracks"].values():
-		entry = track_separator.join([
+# transliterators are expensive to create, so a single one is shared (it's only used from the event loop thread)
+TO_LATIN = Transliterator.createInstance("Any-Latin")
+
+@lru_cache(maxsize=65536)
+def transliterate(text: str) -> str:
+	return TO_LATIN.transliterate(text)
+
+# release message formatter
+# the release data is gathered once, and the tracklist entries are only rendered again when their link changes,
+# so rendering the caption after every uploaded track only formats the new entry
+class ReleaseFormatter:
+	def __init__(self, release_string: str, release: dict, channel_type: Literal['opus','orig'], track_separator: str = '. '):
+		self.release_string = release_string
+		self.release = release
+		self.link_field = 'link_'+channel_type
+		self.track_separator = track_separator
+		# init other formatting data (subject to expansion)
+		self.formatting_data = {
+			'album': get_tag_fom_first_track(release, 'album'),
+			'albumartist': get_tag_fom_first_track(release, 'albumartist'),
+			'date': get_tag_fom_first_track(release, 'date'),
+			'totaltracks': get_tag_fom_first_track(release, 'totaltracks'),
+			'depth_rates': ', '.join(set(f'{track["depth"]}/{int(track["rate"])/1000}' for track in release["tracks"].values() ))
+		}
+		# track filename: (link, rendered entry)
+		self.entries: dict[str,tuple[str|None,str]] = {}
+
+	def render_entry(self, track: dict) -> str:
+		entry = self.track_separator.join([
 				track["tags"]["tracknumber"][0],
-				to_latin.transliterate(track["tags"]["title"][0])
+				transliterate(track["tags"]["title"][0])
 		])
-		if link_field in track.keys():
-			latin_tracklist += f'\n[{entry}]({track[link_field]})'
-		else:
-			latin_tracklist += f'\n{entry}'
-	return release_string.format(**formatting_data, latin_tracklist=latin_tracklist)
+		if self.link_field in track.keys():
+			return f'\n[{entry}]({track[self.link_field]})'
+		return f'\n{entry}'
+
+	def render(self) -> str:
+		for filename, track in self.release["tracks"].items():
+			link = track.get(self.link_field)
+			cached = self.entries.get(filename)
+			if cached is None or cached[0] != link:
+				self.entries[filename] = (link, self.render_entry(track))
+		latin_tracklist = ''.join( self.entries[filename][1] for filename in self.release["tracks"].keys() )
+		return self.release_string.format(**self.formatting_data, latin_tracklist=latin_tracklist)
+
+def format_release_string(release_string: str, release: dict, channel_type: Literal['opus','orig'], track_separator: str = '. ') -> str:
+	return ReleaseFormatter(release_string, release, channel_type, track_separator).render()
 
 # prepare the release artwork according to the telegram rules:
 # height and width <= 2560px
 # size <= 10M
 # either PNG or JPEG
-def prepare_artwork(img: Image.Image, path: str):
-	if( os.path.getsize(img.filename)/1024/1024 > 10 or
+# file_size is needed for images not opened from a file
+def prepare_artwork(img: Image.Image, path: str, file_size: int|None = None):
+	if file_size is None:
+		file_size = os.path.getsize(img.filename)
+	if( file_size/1024/1024 > 10 or
 			img.height > 2560 or img.width > 2560 or
 			img.format not in ('PNG', 'JPEG') ):
 		divider = img.width/2560 if img.width < img.height else img.height/2560
-		img = img.resize(( int(img.width//divider), int(img.height//divider) ))
+		img = downscale(img, ( int(img.width//divider), int(img.height//divider) ))
 	img = img.convert('RGB')
 	img.save(path, "jpeg", quality=77)
 
@@ -86,10 +123,17 @@ def prepare_artwork(img: Image.Image, path: str):
 # size <= 200K
 def prepare_thumbnail(img: Image.Image, path):
 	divider = img.width/320 if img.width < img.height else img.height/320
-	img = img.resize(( int(img.width//divider), int(img.height//divider) ))
+	img = downscale(img, ( int(img.width//divider), int(img.height//divider) ))
 	img = img.convert('RGB')
 	img.save(path, "jpeg", quality=77)
 
+# resize the image, letting the JPEG decoder skip the unneeded resolution
+# draft() only reduces by powers of 2 and keeps the image at least as large as requested
+def downscale(img: Image.Image, size: tuple[int,int]) -> Image.Image:
+	if img.format == 'JPEG' and size[0] < img.width and size[1] < img.height:
+		img.draft('RGB', size)
+	return img.resize(size)
+
 # choose the "best" artwork based on filename
 def get_best_artwork(
 			images: list[str],
@@ -148,7 +192,7 @@ def optimized_artwork_search(
 # remove tag(s) from a mutagen opus representation safely
 def mutagen_safe_pop(muta: mutagen_opus.OggOpus, tags: tuple[str, ...]|str):
 	keys = muta.keys()
-	if isinstance(tags, list):
+	if isinstance(tags, (list, tuple)):
 		for tag in tags:
 			if tag in keys:
 				muta.pop(tag)
@@ -164,7 +208,8 @@ def encode_opus(
 			rg_mode: RG_Mode	= RG_Mode.NONE,
 			rg_clip: RG_Clip	= RG_Clip.NONE,
 			artwork: str|None	= None,
-			ffmpeg_path: str	= 'ffmpeg'
+			ffmpeg_path: str	= 'ffmpeg',
+			gain_tags: dict|None	= None
 	):
 	command = [
 			ffmpeg_path,
@@ -176,11 +221,78 @@ def encode_opus(
 	]
 	if subprocess.run(command).returncode != 0:
 		raise Exception(f'Ffmpeg command exited with a non-zero return code. Command: {command}.')
-	# handle ReplayGain and R128
-	muta = mutagen_opus.Open(out_path)
+	with open(out_path, 'r+b') as file:
+		apply_opus_tags(file, track_path, rg_mode, rg_clip, artwork, gain_tags)
+
+# size of the encoded track above which encode_opus_stream continues on disk
+SPILL_SIZE = 64*1024**2
+
+# encode the track through an ffmpeg pipe and apply the tags in memory, without any temporary file
+# returns the in-memory file (named after out_path, as pyrogram needs for uploads),
+# or out_path, if the encoded track got larger than spill_size and was written there instead
+def encode_opus_stream(
+			track_path: str,
+			out_path: str,
+			bitrate: int		= 96,
+			rg_mode: RG_Mode	= RG_Mode.NONE,
+			rg_clip: RG_Clip	= RG_Clip.NONE,
+			artwork: str|None	= None,
+			ffmpeg_path: str	= 'ffmpeg',
+			spill_size: int		= SPILL_SIZE,
+			gain_tags: dict|None	= None
+	) -> io.BytesIO|str:
+	command = [
+			ffmpeg_path,
+			'-i',	track_path,
+			'-c:a',	'libopus',
+			'-b:a',	f'{bitrate}k',
+			'-f',	'opus',
+			'pipe:1'
+	]
+	process = subprocess.Popen(command, stdout=subprocess.PIPE)
+	out = io.BytesIO()
+	try:
+		for chunk in iter(lambda: process.stdout.read(1024*1024), b''):
+			if isinstance(out, io.BytesIO) and out.tell()+len(chunk) > spill_size:
+				spill = open(out_path, 'w+b')
+				spill.write(out.getbuffer())
+				out = spill
+			out.write(chunk)
+		if process.wait() != 0:
+			raise Exception(f'Ffmpeg command exited with a non-zero return code. Command: {command}.')
+		out.seek(0)
+		apply_opus_tags(out, track_path, rg_mode, rg_clip, artwork, gain_tags)
+	finally:
+		process.stdout.close()
+		if process.poll() is None:
+			process.kill()
+			process.wait()
+		if not isinstance(out, io.BytesIO):
+			out.close()
+	if not isinstance(out, io.BytesIO):
+		return out_path
+	out.seek(0)
+	out.name = path.basename(out_path)
+	return out
+
+# handle ReplayGain, R128 and artwork of the encoded opus file (any seekable binary file object)
+# gain_tags (like the ones computed by analyze_gain) are used where the source file lacks them
+def apply_opus_tags(
+			file: BinaryIO,
+			track_path: str,
+			rg_mode: RG_Mode	= RG_Mode.NONE,
+			rg_clip: RG_Clip	= RG_Clip.NONE,
+			artwork: str|None	= None,
+			gain_tags: dict|None	= None
+	):
+	muta = mutagen_opus.OggOpus(file)
+	if gain_tags is not None:
+		for tag, value in gain_tags.items():
+			if tag not in muta:
+				muta[tag] = value
 	if rg_mode == RG_Mode.NONE:
 		mutagen_safe_pop( muta, (*RG_TAGLIST, *R128_TAGLIST, *MP3GAIN_TAGLIST) )
-		muta.save()
+		muta.save(file)
 	elif rg_mode == RG_Mode.REPLAYGAIN:
 		if 'replaygain' not in [key[:10] for key in muta.keys()]:
 			if 'r128_track_gain' in muta.keys():
@@ -224,24 +336,27 @@ def encode_opus(
 				absgain = db_gain(float(muta['replaygain_album_gain'][0]
 							.lower().removesuffix('db').removesuffix('lufs')))
 				muta['replaygain_track_gain'] =	f'{20*log10(absgain/compensated_peak):.2f} LUFS'
-		muta.save()
+		muta.save(file)
 	elif rg_mode == RG_Mode.R128:
 		if 'r128_track_gain' not in muta.keys():
 			rg_track_gain = muta.get('replaygain_track_gain')
 			if rg_track_gain is not None:
-				db = float( rg_track_gain.lower().removesuffix('db').removesuffix('lufs') )
-				muta['r128_track_gain'] = float_to_q7dot8(db)
+				db = float( rg_track_gain[0].lower().removesuffix('db').removesuffix('lufs') )
+				muta['r128_track_gain'] = str(float_to_q7dot8(db))
 			else:
 				raise Exception(f"Track gain information is missing in '{track_path}'.")
 		if 'r128_album_gain' not in muta.keys():
 			header_gain = 0
 			rg_album_gain = muta.get('replaygain_album_gain')
 			if rg_album_gain is not None:
-				db = float( rg_album_gain.lower().removesuffix('db').removesuffix('lufs') )
-				muta['r128_album_gain'] = 0
-				muta['r128_track_gain'] = float_to_q7dot8(muta['r128_track_gain']/256 - db)
-				muta.save()
-				write_opus_gain(open(out_path, 'r+b'), float_to_q7dot8(db))
+				db = float( rg_album_gain[0].lower().removesuffix('db').removesuffix('lufs') )
+				muta['r128_album_gain'] = '0'
+				muta['r128_track_gain'] = str(float_to_q7dot8(int(muta['r128_track_gain'][0])/256 - db))
+				muta.save(file)
+				# the header gain writer expects the file positioned by the parser
+				file.seek(0)
+				parse_opus_gain(file)
+				write_opus_gain(file, float_to_q7dot8(db))
 		mutagen_safe_pop( muta, (*RG_TAGLIST, *MP3GAIN_TAGLIST) )
 	# if given artwork, embed it
 	if artwork is not None:
@@ -249,9 +364,129 @@ def encode_opus(
 		img.data = open(artwork, 'rb').read()
 		img.type = 3	# type 3 stands for cover art
 		muta['metadata_block_picture'] = b64encode(img.write()).decode('ascii')
-	muta.save()
+	muta.save(file)
+
+# directory of files addressed by a key
+# the least recently used files are evicted when the cache exceeds max_size bytes
+class FileCache:
+	suffix = ''
+
+	def __init__(self, root: str, max_size: int):
+		self.root = root
+		self.max_size = max_size
+		os.makedirs(root, exist_ok=True)
+
+	def _path(self, key: str) -> str:
+		return path.join(self.root, key+self.suffix)
+
+	# get the cached file path, or None if the key is missing
+	def get(self, key: str) -> str|None:
+		cached = self._path(key)
+		try:
+			# mtime is used as the last access time for LRU eviction
+			os.utime(cached)
+		except FileNotFoundError:
+			return None
+		return cached
+
+	# atomically move a file written next to the cache into it
+	def _commit(self, key: str, tmp_path: str) -> str:
+		cached = self._path(key)
+		os.replace(tmp_path, cached)
+		self.evict()
+		return cached
+
+	def _tmp_path(self, key: str) -> str:
+		return path.join(self.root, f'{key}.{uuid4().hex}.tmp')
+
+	# remove the least recently used files until the cache fits max_size
+	def evict(self):
+		entries = []
+		for entry in os.scandir(self.root):
+			if entry.name.endswith(self.suffix):
+				try:
+					stat = entry.stat()
+				except FileNotFoundError:
+					continue
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
+		total = sum(size for _, size, _ in entries)
+		for _, size, file_path in sorted(entries):
+			if total <= self.max_size:
+				break
+			try:
+				os.remove(file_path)
+			except FileNotFoundError:
+				pass
+			total -= size
+
+# persistent cache of encoded opus files
+# files are keyed by the source file (path, size, mtime), encoding settings and embedded artwork
+class OpusCache(FileCache):
+	suffix = '.opus'
+
+	def __init__(self, root: str, max_size: int = 10*1024**3):
+		super().__init__(root, max_size)
+
+	def key(
+			self,
+			track_path: str,
+			bitrate: int,
+			rg_mode: RG_Mode,
+			rg_clip: RG_Clip,
+			artwork: str|None = None,
+			gain_tags: dict|None = None
+		) -> str:
+		stat = os.stat(track_path)
+		artwork_hash = None
+		if artwork is not None:
+			with open(artwork, 'rb') as file:
+				artwork_hash = hashlib.blake2b(file.read()).hexdigest()
+		return hashlib.blake2b(json.dumps([
+				os.path.realpath(track_path), stat.st_size, stat.st_mtime,
+				bitrate, str(rg_mode), str(rg_clip), artwork_hash, gain_tags
+		]).encode(), digest_size=20).hexdigest()
+
+	# copy the encoded file (a path or an in-memory file) into the cache
+	def put(self, key: str, encoded: str|io.BytesIO) -> str:
+		tmp_path = self._tmp_path(key)
+		if isinstance(encoded, io.BytesIO):
+			with open(tmp_path, 'wb') as file:
+				file.write(encoded.getbuffer())
+		else:
+			copyfile(encoded, tmp_path)
+		return self._commit(key, tmp_path)
+
+# persistent cache of prepared thumbnails and artworks, keyed by the source image content,
+# so the same picture is processed once for all the tracks and releases that use it
+class ImageCache(FileCache):
+	suffix = '.jpg'
+
+	def __init__(self, root: str, max_size: int = 256*1024**2):
+		super().__init__(root, max_size)
+
+	# get the prepared image path for the source image data
+	def prepare(self, data: bytes, kind: Literal['thumb','artwork']) -> str:
+		key = f'{hashlib.blake2b(data, digest_size=20).hexdigest()}_{kind}'
+		cached = self.get(key)
+		if cached is not None:
+			return cached
+		tmp_path = self._tmp_path(key)
+		img = Image.open(io.BytesIO(data))
+		if kind == 'thumb':
+			prepare_thumbnail(img, tmp_path)
+		else:
+			prepare_artwork(img, tmp_path, len(data))
+		return self._commit(key, tmp_path)
+
+	def prepare_file(self, file_path: str, kind: Literal['thumb','artwork']) -> str:
+		with open(file_path, 'rb') as file:
+			return self.prepare(file.read(), kind)
 
 def extract_embedded_image(src: str, out: str):
+	with open(out, 'wb') as file:
+		file.write(read_embedded_image(src))
+
+def read_embedded_image(src: str) -> bytes:
 	mutafile = mutagen._file.File(src)
 	if mutafile is None:
 		raise Exception(f'Couldn\'t open {src} using mutagen')
@@ -261,19 +496,18 @@ def extract_embedded_image(src: str, out: str):
 		if apic is None:
 			raise Exception(f'Track {src} contains no embedded image')
 		else:
-			open(out, 'wb').write(apic.data)
+			return apic.data
 	elif isinstance(tags, mutagen.apev2.APEv2):
 		for name, value in tags.items():
 			if name.lower().startswith("cover art") and value.kind == mutagen.apev2.BINARY:
-				open(out, 'wb').write( value.value.split(b'\0', 1)[1] )
-				return
+				return value.value.split(b'\0', 1)[1]
 		raise Exception(f"Embeded image missing in: {src}")
 	elif isinstance(tags, mutagen.mp4.MP4Tags):
 		covr = tags.get('covr')
 		if covr is None:
 			raise Exception(f'Track {src} contains no embedded image')
 		else:
-			open(out, 'wb').write( covr[0] )
+			return bytes(covr[0])
 	elif isinstance(tags, mutagen._vorbis.VCommentDict):
 		if ("metadata_block_picture" in tags):
 			data = Picture( b64decode(tags['metadata_block_picture'][0]) ).data
@@ -281,51 +515,87 @@ def extract_embedded_image(src: str, out: str):
 			data = mutafile.pictures[0].data
 		else:
 			raise Exception(f"Embeded image missing in: {src}")
-		open(out,'wb').write( data )
+		return data
 	elif isinstance(tags, mutagen.asf.ASFTags):
 		pic_tag = tags.get('WM/Picture')
 		if pic_tag is None:
 			raise Exception(f'Track {src} contains no embedded image')
 		else:
 			v = pic_tag[0].value
-			open(out,'wb').write( v[v.find(255):] )
+			return v[v.find(255):]
+	raise Exception(f"Unsupported tags in: {src}")
 
-async def send_track(
-		client: Client,
+# prepare the track for sending: its thumbnail and, for the opus channel, the encoded file
+# temporary files are named after the given prefix, so that several tracks can be prepared at once
+# returns (track_path, thumb_file), the encoded track is usually an in-memory file
+def prepare_track(
 		release: dict,
 		track_filename: str,
 		release_path: str,
 		album_thumbnail: bool,
-		channel: str,
 		tmp_dir: str,
 		fallback_thumbnail: str,
 		opus_settings: dict|None,
-		callback: Callable = lambda: None
-	):
+		callback: Callable = lambda **d: None,
+		tmp_prefix: str = 'track',
+		opus_cache: OpusCache|None = None,
+		image_cache: ImageCache|None = None
+	) -> tuple[str|io.BytesIO,str]:
 	track = release['tracks'][track_filename]
 	callback(operation="Preparing track thumbnail")
 	# find best image
-	if track['embedded_image']:
-		extract_embedded_image(path.join(release_path,track_filename), path.join(tmp_dir,'track_thumb.jpg'))
-		prepare_thumbnail(path.join(tmp_dir,'track_thumb.jpg'),path.join(tmp_dir,'track_thumb.jpg'))
-		thumb_file = path.join(tmp_dir,'track_thumb.jpg')
+	if track['embedded_image'] and image_cache is not None:
+		thumb_file = image_cache.prepare(read_embedded_image(path.join(release_path,track_filename)), 'thumb')
+	elif track['embedded_image']:
+		thumb_file = path.join(tmp_dir,f'{tmp_prefix}_thumb.jpg')
+		extract_embedded_image(path.join(release_path,track_filename), thumb_file)
+		prepare_thumbnail(Image.open(thumb_file), thumb_file)
 	elif album_thumbnail:
 		thumb_file = path.join(tmp_dir,'album_thumb.jpg')
 	else:
 		thumb_file = fallback_thumbnail
 	track_path = path.join(release_path,track_filename)
 	if isinstance(opus_settings, dict):
+		encoding = {
+			'bitrate': opus_settings['bitrate'],
+			'rg_mode': opus_settings['replaygain']['mode'],
+			'rg_clip': opus_settings['replaygain']['clipping_policy'],
+			'artwork': thumb_file if opus_settings['embed_cover'] else None,
+			'gain_tags': dict( (tag, track['tags'][tag]) for tag in track['computed_gain'] ) if 'computed_gain' in track else None
+		}
+		# cache hits skip ffmpeg entirely
+		if opus_cache is not None:
+			cache_key = opus_cache.key(track_path, **encoding)
+			cached = opus_cache.get(cache_key)
+			if cached is not None:
+				return cached, thumb_file
 		callback(operation='Encoding')
-		encode_opus(
+		track_path = encode_opus_stream(
 				track_path,
-				path.join(tmp_dir,'track.opus'),
-				bitrate=opus_settings['bitrate'],
-				rg_mode=opus_settings['replaygain']['mode'],
-				rg_clip=opus_settings['replaygain']['clipping_policy'],
-				artwork=thumb_file if opus_settings['embed_cover'] else None
+				path.join(tmp_dir,f'{tmp_prefix}.opus'),
+				**encoding,
+				spill_size=opus_settings.get('spill_size', SPILL_SIZE//1024**2)*1024**2
 		)
-		track_path = path.join(tmp_dir,'track.opus')
-	# send track
+		if opus_cache is not None:
+			opus_cache.put(cache_key, track_path)
+	return track_path, thumb_file
+
+# send the prepared track and save the message info
+async def send_prepared_track(
+		client: Client,
+		release: dict,
+		track_filename: str,
+		release_path: str,
+		channel: str,
+		track_path: str|io.BytesIO,
+		thumb_file: str,
+		opus_settings: dict|None,
+		callback: Callable = lambda **d: None,
+		journal: Journal|None = None
+	):
+	if journal is None:
+		journal = Journal()
+	track = release['tracks'][track_filename]
 	msg = await client.send_audio(
 			channel,
 			track_path,
@@ -336,24 +606,166 @@ async def send_track(
 			progress=(lambda current,total: callback(operation='Sending', current=current, total=total))
 	)
 	if isinstance(msg, pyrogram.types.Message):
-		if isinstance(opus_settings, dict):
-			release['tracks'][track_filename]['id_opus'] = msg.id
-			release['tracks'][track_filename]['link_opus'] = msg.link
-		else:
-			release['tracks'][track_filename]['id_orig'] = msg.id
-			release['tracks'][track_filename]['link_orig'] = msg.link
+		short_type = 'opus' if isinstance(opus_settings, dict) else 'orig'
+		journal.set(release, release_path, 'id_'+short_type, msg.id, 'tracks', track_filename)
+		journal.set(release, release_path, 'link_'+short_type, msg.link, 'tracks', track_filename)
 	else:
 		raise Exception(f'Couldn\'t upload {path.join(release_path,track_filename)}.')
 
-def remove_release_links(release: dict, link_field: str):
-	release.pop(link_field)
-	for track in release['tracks'].values():
-		track.pop(link_field)
+async def send_track(
+		client: Client,
+		release: dict,
+		track_filename: str,
+		release_path: str,
+		album_thumbnail: bool,
+		channel: str,
+		tmp_dir: str,
+		fallback_thumbnail: str,
+		opus_settings: dict|None,
+		callback: Callable = lambda **d: None,
+		journal: Journal|None = None,
+		opus_cache: OpusCache|None = None,
+		image_cache: ImageCache|None = None
+	):
+	track_path, thumb_file = prepare_track(
+			release,
+			track_filename,
+			release_path,
+			album_thumbnail,
+			tmp_dir,
+			fallback_thumbnail,
+			opus_settings,
+			callback,
+			opus_cache=opus_cache,
+			image_cache=image_cache
+	)
+	await send_prepared_track(
+			client,
+			release,
+			track_filename,
+			release_path,
+			channel,
+			track_path,
+			thumb_file,
+			opus_settings,
+			callback,
+			journal
+	)
 
+# send the tracks in the given order, preparing (encoding) up to "prefetch" next tracks
+# in background threads while the current one is being sent
+# yields the filename of every sent track, so that the caller can update the release message
+async def send_tracks(
+		client: Client,
+		release: dict,
+		track_filenames: list[str],
+		release_path: str,
+		album_thumbnail: bool,
+		channel: str,
+		tmp_dir: str,
+		fallback_thumbnail: str,
+		opus_settings: dict|None,
+		callback: Callable = lambda **d: None,
+		journal: Journal|None = None,
+		prefetch: int = 2,
+		opus_cache: OpusCache|None = None,
+		image_cache: ImageCache|None = None
+	):
+	loop = asyncio.get_running_loop()
+	# a client pool sends several tracks at once and keeps them in order by itself
+	concurrency = client.concurrency if isinstance(client, ClientPool) else 1
+	prefetch = max(prefetch, concurrency)
+	executor = ThreadPoolExecutor(max_workers=max(1, prefetch))
+	queue = deque()
+	sends = deque()
+	pending = iter(enumerate(track_filenames))
+	# temporary file prefixes of all the scheduled preparations
+	tmp_prefixes = []
+	# schedule the preparation of the next track, callbacks are passed back to the event loop thread
+	def prepare_next():
+		for number, filename in pending:
+			tmp_prefixes.append(f'track_{number}')
+			track_callback = lambda filename=filename, **d: loop.call_soon_threadsafe(
+					lambda: callback(track=filename, **d))
+			queue.append((
+				filename,
+				f'track_{number}',
+				loop.run_in_executor(
+						executor,
+						prepare_track,
+						release,
+						filename,
+						release_path,
+						album_thumbnail,
+						tmp_dir,
+						fallback_thumbnail,
+						opus_settings,
+						track_callback,
+						f'track_{number}',
+						opus_cache,
+						image_cache
+				)
+			))
+			return
+	def remove_tmp_files(tmp_prefix: str):
+		for tmp_file in (f'{tmp_prefix}.opus', f'{tmp_prefix}_thumb.jpg'):
+			if path.isfile(path.join(tmp_dir, tmp_file)):
+				os.remove(path.join(tmp_dir, tmp_file))
+	async def send(filename: str, tmp_prefix: str, track_path: str|io.BytesIO, thumb_file: str) -> str:
+		await send_prepared_track(
+				client,
+				release,
+				filename,
+				release_path,
+				channel,
+				track_path,
+				thumb_file,
+				opus_settings,
+				lambda filename=filename, **d: callback(track=filename, **d),
+				journal
+		)
+		remove_tmp_files(tmp_prefix)
+		return filename
+	try:
+		for _ in range(max(1, prefetch)):
+			prepare_next()
+		while len(queue) > 0 or len(sends) > 0:
+			# the finished sends waiting for a slower earlier track don't count
+			while len(queue) > 0 and sum(not task.done() for task in sends) < concurrency:
+				filename, tmp_prefix, future = queue.popleft()
+				track_path, thumb_file = await future
+				prepare_next()
+				# tasks start in the order they are created, so the sends are issued in the tracklist order
+				sends.append(asyncio.create_task(send(filename, tmp_prefix, track_path, thumb_file)))
+			if not sends[0].done():
+				await asyncio.wait([task for task in sends if not task.done()], return_when=asyncio.FIRST_COMPLETED)
+			while len(sends) > 0 and sends[0].done():
+				yield sends.popleft().result()
+	finally:
+		for task in sends:
+			task.cancel()
+		await asyncio.gather(*sends, return_exceptions=True)
+		# wait for the running preparations (the queued ones are cancelled),
+		# so that the tracks prepared but not sent don't leave their (spilled) files behind
+		await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+		for tmp_prefix in tmp_prefixes:
+			remove_tmp_files(tmp_prefix)
+
+# release_path is the key of the release in the database, which the journal entries refer to
+def remove_release_links(release: dict, link_field: str, release_path: str, journal: Journal|None = None):
+	if journal is None:
+		journal = Journal()
+	journal.pop(release, release_path, link_field)
+	for filename in release['tracks'].keys():
+		journal.pop(release, release_path, link_field, 'tracks', filename)
+
+# caption edits are coalesced through the ClientScheduler, which has to be the same for all the releases,
+# so that its budgets and flood waits span them
+# with a ClientPool, the tracks are uploaded by all of its sessions at once
 async def upload_release(
 		release: dict,
 		release_path: str,
-		client: Client,
+		client: ClientScheduler,
 		channel: str,
 		tmp_dir: str,
 		assets_dir: str,
@@ -361,59 +773,86 @@ async def upload_release(
 		preferred_names: list[str],
 		preferred_exts: list[str],
 		opus_settings: dict|None,
-		callback: Callable
+		callback: Callable,
+		journal: Journal|None = None,
+		prefetch: int = 2,
+		opus_cache: OpusCache|None = None,
+		image_cache: ImageCache|None = None
 	):
+	if journal is None:
+		journal = Journal()
+	if not isinstance(client, ClientScheduler):
+		raise Exception('upload_release needs a ClientScheduler, create one along with the client.')
 	if isinstance(opus_settings, dict):
 		short_type = 'opus'
 	else:
 		short_type = 'orig'
 	id_field = 'id_'+short_type
 	link_field = 'link_'+short_type
+	formatter = ReleaseFormatter(release_string, release, short_type)
 	callback(operation="Preparing release images")
 	# detect best image
 	if len(release['images']) > 0:
-		best_image = Image.open(path.join(release_path, get_best_artwork(release['images'], preferred_names, preferred_exts)))
+		best_image_path = path.join(release_path, get_best_artwork(release['images'], preferred_names, preferred_exts))
 		album_thumbnail = True
-		prepare_thumbnail(best_image, path.join(tmp_dir,'album_thumb.jpg'))
+		if image_cache is not None:
+			copyfile(image_cache.prepare_file(best_image_path, 'thumb'), path.join(tmp_dir,'album_thumb.jpg'))
+		else:
+			prepare_thumbnail(Image.open(best_image_path), path.join(tmp_dir,'album_thumb.jpg'))
 	else:
-		best_image = None
+		best_image_path = None
 		album_thumbnail = False
 	# uploading stage
 	# if release message was already uploaded, proceed to upload the missing tracks
 	if id_field in release.keys():
-		for filename,track in dict(natsorted((k,v) for k,v in release['tracks'].items() if id_field not in v)):
-			await send_track(
+		async with aclosing(send_tracks(
 					client,
 					release,
-					filename,
+					natsorted(k for k,v in release['tracks'].items() if id_field not in v),
 					release_path,
 					album_thumbnail,
 					channel,
 					tmp_dir,
 					path.join(assets_dir, 'fallback_thumb.jpg'),
 					opus_settings,
-					lambda operation, current=None, total=None:
-						callback(operation=operation, track=filename, current=current, total=total),
-			)
-			if '{latin_tracklist' in release_string:
-				msg = await client.edit_message_caption(
-						channel,
-						release[id_field],
-						format_release_string(release_string, release, short_type))
-				if not isinstance(msg, pyrogram.types.Message):
-					raise Exception('Message edit error.', 'Could not update the release message with new info. Message id: {release[id_field]}')
-		remove_release_links(release, link_field)
+					lambda operation, track, current=None, total=None:
+						callback(operation=operation, track=track, current=current, total=total),
+					journal,
+					prefetch,
+					opus_cache,
+					image_cache
+			)) as sent_tracks:
+			try:
+				async for filename in sent_tracks:
+					if '{latin_tracklist' in release_string:
+						client.schedule_caption(
+								channel,
+								release[id_field],
+								formatter.render)
+			finally:
+				await client.flush_captions(channel, release[id_field])
+				if isinstance(client, ClientPool):
+					await client.clean_staging()
+		remove_release_links(release, link_field, release_path, journal)
 	# if release message has not been uploaded yet, send the first message and upload the tracks
 	else:
 		# release message
 		# artwork preparation
-		if best_image is not None:
-			prepare_artwork(best_image, path.join(tmp_dir,'album_artwork.jpg'))
+		if best_image_path is not None:
+			if image_cache is not None:
+				copyfile(image_cache.prepare_file(best_image_path, 'artwork'), path.join(tmp_dir,'album_artwork.jpg'))
+			else:
+				prepare_artwork(Image.open(best_image_path), path.join(tmp_dir,'album_artwork.jpg'))
 		elif any( [track['embedded_image'] for track in release['tracks'].values()] ):
 			for filename,track in release['tracks'].items():
 				if track['embedded_image']:
-					extract_embedded_image(path.join(release_path,filename), path.join(tmp_dir,'album_artwork.jpg'))
-					prepare_artwork(Image.open(path.join(tmp_dir,'album_artwork.jpg')), path.join(tmp_dir,'album_artwork.jpg'))
+					if image_cache is not None:
+						copyfile(
+								image_cache.prepare(read_embedded_image(path.join(release_path,filename)), 'artwork'),
+								path.join(tmp_dir,'album_artwork.jpg'))
+					else:
+						extract_embedded_image(path.join(release_path,filename), path.join(tmp_dir,'album_artwork.jpg'))
+						prepare_artwork(Image.open(path.join(tmp_dir,'album_artwork.jpg')), path.join(tmp_dir,'album_artwork.jpg'))
 					break
 		else:
 			copyfile(path.join(assets_dir,'fallback_artwork.jpg'), path.join(tmp_dir,'album_artwork.jpg'))
@@ -421,52 +860,110 @@ async def upload_release(
 		msg = await client.send_photo(
 				channel,
 				path.join(tmp_dir,'album_artwork.jpg'),
-				caption=format_release_string(release_string, release, short_type)
+				caption=formatter.render()
 		)
 		# if release message sent successfully, proceed to sending the tracks
 		if isinstance(msg, pyrogram.types.Message):
-			release[id_field] = msg.id
-			release[link_field] = msg.id
-			for filename in release['tracks'].keys():
-				await send_track(
+			journal.set(release, release_path, id_field, msg.id)
+			journal.set(release, release_path, link_field, msg.id)
+			async with aclosing(send_tracks(
 						client,
 						release,
-						filename,
+						[*release['tracks'].keys()],
 						release_path,
 						album_thumbnail,
 						channel,
 						tmp_dir,
 						path.join(assets_dir, 'fallback_thumb.jpg'),
 						opus_settings,
-						lambda operation, current=None, total=None:
-							callback(operation=operation, track=filename, current=current, total=total),
-				)
-				if '{latin_tracklist' in release_string:
-					msg = await client.edit_message_caption(
-							channel,
-							release[id_field],
-							format_release_string(release_string, release, short_type))
-					if not isinstance(msg, pyrogram.types.Message):
-						raise Exception('Message edit error.', 'Could not update the release message with new info. Message id: {release[id_field]}')
-				callback(operation='Track sent successfully', track=filename)
+						lambda operation, track, current=None, total=None:
+							callback(operation=operation, track=track, current=current, total=total),
+						journal,
+						prefetch,
+						opus_cache,
+						image_cache
+				)) as sent_tracks:
+				try:
+					async for filename in sent_tracks:
+						if '{latin_tracklist' in release_string:
+							client.schedule_caption(
+									channel,
+									release[id_field],
+									formatter.render)
+						callback(operation='Track sent successfully', track=filename)
+				finally:
+					await client.flush_captions(channel, release[id_field])
+					if isinstance(client, ClientPool):
+						await client.clean_staging()
 			# after finishing the full release upload, clean up the links
-			remove_release_links(release, link_field)
+			remove_release_links(release, link_field, release_path, journal)
 		else:
 			raise Exception(f'Couldn\'t upload {release_path}.')
 
-# delete message if id is present in the given dict
-async def safe_delete_message(client: Client, channel: str, name: str, id_field: str, file: dict):
+# delete message if id is present in the release dict (or its file, if filetype and filename are given)
+async def safe_delete_message(
+		client: Client,
+		channel: str,
+		release: dict,
+		release_path: str,
+		id_field: str,
+		journal: Journal,
+		filetype: str|None = None,
+		filename: str|None = None
+	):
+	file = release if filetype is None else release[filetype][filename]
 	if id_field in file.keys():
 		result = await client.delete_messages(channel, file[id_field])
 		if isinstance(result,int):
-			file.pop(id_field)
+			journal.pop(release, release_path, id_field, filetype, filename)
 		else:
-			raise Exception(f'Could not delete message #{file[id_field]} ({name})')
+			raise Exception(f'Could not delete message #{file[id_field]} ({filename or "release"})')
 
 # delete a whole release based on the database dict
-async def delete_release_from_telegram(release: dict, client: Client, channel: str, channel_type: Literal['orig','opus']):
+# release_path is its key in the database, which the journal entries refer to
+async def delete_release_from_telegram(
+		release: dict,
+		client: Client,
+		channel: str,
+		channel_type: Literal['orig','opus'],
+		release_path: str,
+		journal: Journal|None = None
+	):
+	await delete_releases_from_telegram({release_path: release}, client, channel, channel_type, journal)
+
+# delete the messages of many releases (release_path: release) in batches
+# the id fields are removed from the database only after their whole batch is deleted,
+# so a failed or partially deleted batch leaves its ids (and the ones after it) for the next try
+# returns the amount of messages telegram reported as deleted
+async def delete_releases_from_telegram(
+		releases: dict[str,dict],
+		client: Client,
+		channel: str,
+		channel_type: Literal['orig','opus'],
+		journal: Journal|None = None
+	) -> int:
+	if journal is None:
+		journal = Journal()
 	id_field = 'id_'+channel_type
-	for filetype in ['tracks','images','files']:
-		for filename, file in release[filetype].items():
-			await safe_delete_message(client, channel, filename, id_field, file)
-		await safe_delete_message(client, channel, 'release', id_field, release)
+	# (message id, release, release path, filetype, filename)
+	messages = []
+	for release_path, release in releases.items():
+		for filetype in ['tracks','images','files']:
+			for filename, file in release[filetype].items():
+				if id_field in file.keys():
+					messages.append((file[id_field], release, release_path, filetype, filename))
+		if id_field in release.keys():
+			messages.append((release[id_field], release, release_path, None, None))
+	deleted = 0
+	for start in range(0, len(messages), DELETE_BATCH_SIZE):
+		batch = messages[start:start+DELETE_BATCH_SIZE]
+		result = await client.delete_messages(channel, [message[0] for message in batch])
+		if not isinstance(result,int):
+			raise Exception(f'Could not delete messages #{batch[0][0]}..#{batch[-1][0]}')
+		# some of the messages are already gone, too old or not ours to delete
+		if result < len(batch):
+			raise Exception(f'Deleted only {result} of {len(batch)} messages #{batch[0][0]}..#{batch[-1][0]}')
+		for _, release, release_path, filetype, filename in batch:
+			journal.pop(release, release_path, id_field, filetype, filename)
+		deleted += result
+	return deleted
@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+import time
+from PIL import Image
+from sys import argv
+from tempfile import TemporaryDirectory
+# upload.py imports its neighbours directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'despot'))
+from upload import ImageCache, prepare_thumbnail, prepare_artwork
+
+# compare the per-track thumbnail and artwork preparation with the old full-decode way
+# on high-resolution scans (the given images, or synthetic 6000x6000 JPEG and PNG)
+# simulates a release of 12 tracks with the same embedded picture
+
+tracks_per_release = 12
+
+# the way prepare_thumbnail and prepare_artwork used to resize
+def old_prepare_thumbnail(img: Image.Image, path: str):
+	divider = img.width/320 if img.width < img.height else img.height/320
+	img = img.resize(( int(img.width//divider), int(img.height//divider) ))
+	img.convert('RGB').save(path, "jpeg", quality=77)
+
+def old_prepare_artwork(img: Image.Image, path: str, file_size: int):
+	if file_size/1024/1024 > 10 or img.height > 2560 or img.width > 2560 or img.format not in ('PNG', 'JPEG'):
+		divider = img.width/2560 if img.width < img.height else img.height/2560
+		img = img.resize(( int(img.width//divider), int(img.height//divider) ))
+	img.convert('RGB').save(path, "jpeg", quality=77)
+
+def gen_scan(format: str) -> bytes:
+	img = Image.radial_gradient('L').resize((6000, 6000))
+	img = Image.merge('RGB', (img, img.rotate(90), img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)))
+	buffer = io.BytesIO()
+	img.save(buffer, format, quality=95) if format == 'JPEG' else img.save(buffer, format)
+	return buffer.getvalue()
+
+if len(argv) > 1:
+	scans = {}
+	for file_path in argv[1:]:
+		with open(file_path, 'rb') as file:
+			scans[os.path.basename(file_path)] = file.read()
+else:
+	scans = { 'synthetic.jpg': gen_scan('JPEG'), 'synthetic.png': gen_scan('PNG') }
+
+with TemporaryDirectory() as tmp:
+	for name, data in scans.items():
+		print(f"{name}: {len(data)/1024/1024:.1f} MiB, {Image.open(io.BytesIO(data)).size}")
+		out = os.path.join(tmp, 'out.jpg')
+
+		# old: the artwork and every track thumbnail fully decode the picture
+		t = time.time()
+		old_prepare_artwork(Image.open(io.BytesIO(data)), out, len(data))
+		for _ in range(tracks_per_release):
+			old_prepare_thumbnail(Image.open(io.BytesIO(data)), out)
+		old_time = time.time()-t
+		print(f"\told, per release: {old_time:.3f}s")
+
+		# draft decoding without the cache
+		t = time.time()
+		prepare_artwork(Image.open(io.BytesIO(data)), out, len(data))
+		for _ in range(tracks_per_release):
+			prepare_thumbnail(Image.open(io.BytesIO(data)), out)
+		print(f"\tdraft, per release: {time.time()-t:.3f}s")
+
+		# cache: the first release prepares the images, the next ones only hash the data
+		cache = ImageCache(os.path.join(tmp, name))
+		for release in ('first', 'next'):
+			t = time.time()
+			cache.prepare(data, 'artwork')
+			for _ in range(tracks_per_release):
+				cache.prepare(data, 'thumb')
+			new_time = time.time()-t
+			print(f"\tcache ({release} release): {new_time:.3f}s, saved {old_time-new_time:.3f}s")
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+import time
+from tempfile import TemporaryDirectory
+from fake_client import FakeClient, FakeServer
+from fixtures import gen_release
+# upload.py imports its neighbours directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'despot'))
+from scheduler import ClientPool, ClientScheduler
+from upload import upload_release
+
+assets_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'assets')
+
+# upload a synthetic release through one fake session and through a pool of them,
+# check that the tracks end up in the channel in order and print the per-session throughput,
+# then check that a failed upload leaves nothing in the staging chat
+
+track_count = 24
+track_size = 2*1024**2
+release_string = "{albumartist} - {album} ({date}) [{depth_rates}]\nTracks:{totaltracks}{latin_tracklist}"
+
+async def upload(client, server: FakeServer) -> float:
+	with TemporaryDirectory() as release_path, TemporaryDirectory() as tmp:
+		release = gen_release(track_count, release_path=release_path, track_size=track_size)
+		t = time.time()
+		await upload_release(release, release_path, client, 'channel', tmp, assets_dir,
+				release_string, [], [], None, lambda **d: None)
+		elapsed = time.time()-t
+	titles = list(server.chats['channel'].values())
+	print(f"\tin order: {titles[1:] == [f'Track {t+1}' for t in range(track_count)]}")
+	print(f"\tstaged messages left: {len(server.chats.get('staging', []))}")
+	return elapsed
+
+async def main():
+	print(f"tracks: {track_count} x {track_size/1024**2:.0f} MiB")
+	server = FakeServer()
+	print("single session:")
+	elapsed = await upload(ClientScheduler(FakeClient(server, 0.02, 20*1024**2)), server)
+	print(f"\t{elapsed:.2f}s, {track_count*track_size/elapsed/1024**2:.1f} MiB/s")
+
+	server = FakeServer()
+	bandwidths = (20*1024**2, 20*1024**2, 10*1024**2, 5*1024**2)
+	pool = ClientPool(
+			FakeClient(server, 0.02, bandwidths[0]),
+			[ FakeClient(server, 0.02, bandwidth) for bandwidth in bandwidths ],
+			'staging'
+	)
+	print(f"pool of {len(bandwidths)} sessions:")
+	elapsed = await upload(pool, server)
+	print(f"\t{elapsed:.2f}s, {track_count*track_size/elapsed/1024**2:.1f} MiB/s")
+	for number, (sent_bytes, busy_time, throughput, sent_tracks) in enumerate(pool.throughput()):
+		print(f"\tsession {number}: {sent_tracks} tracks, {sent_bytes/1024**2:.0f} MiB in {busy_time:.2f}s, {throughput/1024**2:.1f} MiB/s")
+
+	server = FakeServer()
+	pool = ClientPool(
+			FakeClient(server, 0.02, bandwidths[0]),
+			[ FakeClient(server, 0.02, 2*1024**2, failures={'send_audio': 2}), *(FakeClient(server, 0.02, bandwidth) for bandwidth in bandwidths[1:]) ],
+			'staging'
+	)
+	print("pool with a failing session:")
+	try:
+		await upload(pool, server)
+	except Exception as e:
+		print(f"\tfailed: {e}")
+	print(f"\ttracks in the channel: {len(server.chats['channel'])-1}/{track_count}")
+	print(f"\tstaged messages left: {len(server.chats.get('staging', []))}")
+
+asyncio.run(main())
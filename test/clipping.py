@@ -11,9 +11,9 @@ t = time.time()
 clipping = {}
 clipping["track"], clipping["album"] = find_clipping_tracks(db["releases"])
 print(f"Clipping track count (using album gain):\
-	{len(clipping['album'])} ({len(clipping['album'])/db['statistics']['total']:1.3})")
+	{len(clipping['album'])} ({len(clipping['album'])/db['statistics']['track_counts']['total']:1.3})")
 print(f"Clipping track count (using track gain):\
-	{len(clipping['track'])} ({len(clipping['track'])/db['statistics']['total']:1.3})")
+	{len(clipping['track'])} ({len(clipping['track'])/db['statistics']['track_counts']['total']:1.3})")
 print(f"clipping detection: {time.time()-t}")
 t = time.time()
 
@@ -0,0 +1,89 @@
+from despot.compact import CompactLibrary
+from despot.library import (calc_stats, find_clipping_tracks, find_tracks_lacking_tag,
+		gen_release_list, report_issues, scan_release)
+from fixtures import gen_mp3, gen_release
+import json
+import mutagen.id3
+import random
+import time
+import tracemalloc
+from os import makedirs, path
+from sys import argv
+from tempfile import TemporaryDirectory
+
+# compare memory usage of the dict releases and the compact representation
+# on a synthetic library (100k tracks by default),
+# then check that the queries and the scan give the same results on both
+
+track_count = int(argv[1]) if len(argv) > 1 else 100000
+tracks_per_release = 12
+
+# generate the library and pass it through json, so the strings are shared
+# exactly as in a database loaded by load_db
+def gen_library() -> str:
+	rng = random.Random(0)
+	releases = {}
+	for r in range(track_count//tracks_per_release):
+		artist = f"Artist {r//5}"
+		date = str(rng.randint(1960, 2023))
+		releases[f"/library/{artist}/{date} - Album {r}"] = gen_release(
+				tracks_per_release, f"Album {r}", artist, date, rng=rng,
+				tags={"discnumber": ["1"], "genre": [rng.choice(("Rock","Jazz","Electronic","Classical","Metal"))]},
+				images={"cover.jpg": {"mtime": time.time()}},
+				files={"rip.log": {"mtime": time.time()}}
+		)
+	return json.dumps(releases, ensure_ascii=False)
+
+serialized = gen_library()
+print(f"tracks: {track_count//tracks_per_release*tracks_per_release}")
+
+tracemalloc.start()
+base = tracemalloc.get_traced_memory()[0]
+t = time.time()
+releases = json.loads(serialized)
+print(f"dict load: {time.time()-t}")
+dict_size = tracemalloc.get_traced_memory()[0] - base
+print(f"dict size: {dict_size/1024/1024:.1f} MiB")
+
+t = time.time()
+library = CompactLibrary(releases)
+print(f"compact conversion: {time.time()-t}")
+# interned strings are shared with the dict, so measure after dropping it
+del releases
+compact_size = tracemalloc.get_traced_memory()[0] - base
+print(f"compact size: {compact_size/1024/1024:.1f} MiB ({compact_size/dict_size:.1%} of dict)")
+tracemalloc.stop()
+
+t = time.time()
+print(f"lossless: {library.to_dict() == json.loads(serialized)}")
+print(f"back conversion and comparison: {time.time()-t}")
+
+# the queries take the compact library in place of the releases dict
+releases = json.loads(serialized)
+for name, query in (
+		("report_issues", lambda releases: report_issues(releases, ["title", "date"], ["genre", "media"])),
+		("find_tracks_lacking_tag", lambda releases: find_tracks_lacking_tag(releases, "media")),
+		("find_clipping_tracks", find_clipping_tracks),
+		("calc_stats", lambda releases: calc_stats(releases, ["title", "date"], ["genre", "media"]))
+	):
+	t = time.time()
+	dict_result = query(releases)
+	dict_time = time.time()-t
+	t = time.time()
+	compact_result = query(library)
+	print(f"{name}: same result: {dict_result == compact_result}, dict: {dict_time:.3f}s, compact: {time.time()-t:.3f}s")
+
+# scan straight into the compact library (silent MP3 frames with ID3 tags)
+with TemporaryDirectory() as root:
+	for r in range(3):
+		release_path = path.join(root, f"Album {r}")
+		makedirs(release_path)
+		for t in range(4):
+			gen_mp3(path.join(release_path, f"{t+1:02} - Track.mp3"), [
+				mutagen.id3.TIT2(encoding=3, text=[f"Track {t+1}"]),
+				mutagen.id3.TRCK(encoding=3, text=[f"{t+1}/4"])
+			])
+	scanned = CompactLibrary()
+	for release_path in gen_release_list(root):
+		scan_release(release_path, library=scanned)
+	print(f"compact scan lossless: {scanned.to_dict() == dict( (p, scan_release(p)) for p in gen_release_list(root) )}")
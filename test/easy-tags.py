@@ -0,0 +1,114 @@
+from despot.library import gen_release_list, form_audio_blob, split_tags
+from fixtures import gen_mp3
+import mutagen._file
+import mutagen.easyid3
+import mutagen.easymp4
+import mutagen.id3
+import mutagen.mp4
+import struct
+import time
+from natsort import natsorted
+from os import makedirs, path, scandir
+from sys import argv, exit
+from tempfile import TemporaryDirectory
+
+# compare the single-parse tag extraction with the old EasyID3/EasyMP4 reopen
+# on every ID3 and MP4 track of the given library, or on generated fixtures
+# (MP3 and M4A files tagged with mutagen) when no library is given
+# fails if any track differs or no track was checked
+
+fixture_count = 20
+
+# the way form_audio_blob used to get the tags
+def reopen_tags(mutafile) -> dict:
+	if isinstance(mutafile.tags, mutagen.id3.ID3):
+		tags = dict( mutagen.easyid3.EasyID3(mutafile.filename).items() )
+	else:
+		tags = dict( mutagen.easymp4.EasyMP4(mutafile.filename).tags.items() )
+	split_tags(tags)
+	return dict( natsorted(tags.items()) )
+
+def gen_tagged_mp3(file_path: str, number: int):
+	gen_mp3(file_path, [
+		mutagen.id3.TIT2(encoding=3, text=[f'Трек {number}']),
+		mutagen.id3.TPE1(encoding=3, text=['Artist', 'Другой']),
+		mutagen.id3.TPE2(encoding=3, text=['Artist']),
+		mutagen.id3.TALB(encoding=3, text=['Album']),
+		mutagen.id3.TDRC(encoding=3, text=['2023-01-02']),
+		mutagen.id3.TRCK(encoding=3, text=[f'{number}/{fixture_count}']),
+		mutagen.id3.TPOS(encoding=3, text=['1/2']),
+		mutagen.id3.TCON(encoding=3, text=['Rock']),
+		mutagen.id3.TMCL(encoding=3, people=[['guitar', 'Someone'], ['drums', 'Someone else']]),
+		mutagen.id3.TXXX(encoding=3, desc='MusicBrainz Album Id', text=['00000000-0000-0000-0000-000000000000']),
+		mutagen.id3.RVA2(desc='track', channel=1, gain=-3.5, peak=0.9)
+	])
+
+# an MP4 with only the movie header (5 seconds long) and iTunes tags
+def gen_m4a(file_path: str, number: int):
+	def atom(name: bytes, data: bytes) -> bytes:
+		return struct.pack('>I', 8+len(data)) + name + data
+	mvhd = atom(b'mvhd', bytes(4) + struct.pack('>4I', 0, 0, 1000, 5000) + bytes(80))
+	with open(file_path, 'wb') as file:
+		file.write(atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A isom') + atom(b'moov', mvhd))
+	mp4 = mutagen.mp4.MP4(file_path)
+	mp4.add_tags()
+	mp4.tags.update({
+		'\xa9nam': [f'Трек {number}'],
+		'\xa9ART': ['Artist'],
+		'aART': ['Artist'],
+		'\xa9alb': ['Album'],
+		'\xa9day': ['2023'],
+		'\xa9gen': ['Rock'],
+		'trkn': [(number, fixture_count)],
+		'disk': [(1, 2)],
+		'----:com.apple.iTunes:MusicBrainz Album Id': [b'00000000-0000-0000-0000-000000000000']
+	})
+	mp4.save()
+
+def gen_library(root: str):
+	for ext, gen in (('mp3', gen_tagged_mp3), ('m4a', gen_m4a)):
+		release_path = path.join(root, 'Artist', f'Album {ext}')
+		makedirs(release_path)
+		for number in range(1, fixture_count+1):
+			gen(path.join(release_path, f'{number:02} - Track.{ext}'), number)
+
+with TemporaryDirectory() as tmp:
+	if len(argv) > 1:
+		root = argv[1]
+	else:
+		root = tmp
+		gen_library(root)
+
+	checked = 0
+	mismatches = []
+	time_single = 0.
+	time_reopen = 0.
+	for release in gen_release_list(root):
+		for entry in scandir(release):
+			if not entry.is_file(follow_symlinks=True):
+				continue
+			try:
+				mutafile = mutagen._file.File(entry.path)
+			except Exception:
+				continue
+			if mutafile is None or not isinstance(mutafile.tags, (mutagen.id3.ID3, mutagen.mp4.MP4Tags)):
+				continue
+			t = time.time()
+			single = form_audio_blob(mutafile)["tags"]
+			time_single += time.time()-t
+			t = time.time()
+			reopened = reopen_tags(mutafile)
+			time_reopen += time.time()-t
+			checked += 1
+			if single != reopened:
+				mismatches.append(entry.path)
+				print(f"Mismatch: '{entry.path}'")
+				print(f"\tsingle-parse: {single}")
+				print(f"\treopened:     {reopened}")
+
+print(f"checked tracks: {checked}")
+print(f"mismatches: {len(mismatches)}")
+print(f"single-parse blob: {time_single}")
+print(f"EasyID3/EasyMP4 reopen: {time_reopen}")
+if checked == 0 or len(mismatches) > 0:
+	exit(1)
@@ -0,0 +1,131 @@
+import asyncio
+import io
+import os
+import random
+from collections import Counter
+import pyrogram.enums
+import pyrogram.types
+from pyrogram.errors import FloodWait
+from pyrogram.sync import async_to_sync
+
+# local stand-in for the subset of the pyrogram Client used by despot
+# (send_audio, send_photo, edit_message_caption, delete_messages, copy_message)
+
+# the chats shared by the fake sessions: chat_id -> {message id: caption or title}
+# several clients on the same server act like several accounts with access to the same chats,
+# e.g. the members of a ClientPool and its staging chat
+class FakeServer:
+	def __init__(self):
+		self.chats: dict[int|str,dict[int,str]] = {}
+		self.last_id = 0
+
+	def post(self, chat_id: int|str, text: str) -> pyrogram.types.Message:
+		self.last_id += 1
+		self.chats.setdefault(chat_id, {})[self.last_id] = text
+		return self.message(chat_id, self.last_id)
+
+	def message(self, chat_id: int|str, message_id: int) -> pyrogram.types.Message:
+		return pyrogram.types.Message(
+				id=message_id,
+				chat=pyrogram.types.Chat(id=-1001, type=pyrogram.enums.ChatType.CHANNEL, username=str(chat_id))
+		)
+
+# a session on the server (a new server of its own if none is given)
+# * latency: seconds added to every call
+# * bandwidth: upload speed in bytes per second for the sent files (None for unlimited)
+# * flood_waits: method -> amount of the next calls that raise FloodWait
+# * flood_rate: probability of any call raising FloodWait, with flood_seconds as its value
+# * failures: method -> number of the call (counting from 1) that fails after the transfer
+# the calls that reached the "server" (including the flooded ones) are counted in calls,
+# the uploaded bytes in sent_bytes
+# like in pyrogram.Client, the methods are wrapped with async_to_sync
+class FakeClient:
+	def __init__(
+			self,
+			server: FakeServer|None = None,
+			latency: float = 0.05,
+			bandwidth: float|None = None,
+			flood_waits: dict[str,int]|None = None,
+			flood_rate: float = 0.,
+			flood_seconds: int = 1,
+			failures: dict[str,int]|None = None,
+			seed: int|None = None
+		):
+		self.server = server if server is not None else FakeServer()
+		self.latency = latency
+		self.bandwidth = bandwidth
+		self.flood_waits = dict(flood_waits or {})
+		self.flood_rate = flood_rate
+		self.flood_seconds = flood_seconds
+		self.failures = dict(failures or {})
+		self.random = random.Random(seed)
+		self.calls = Counter()
+		self.flooded = Counter()
+		self.sent_bytes = 0
+
+	async def _request(self, method: str):
+		self.calls[method] += 1
+		await asyncio.sleep(self.latency)
+		if self.flood_waits.get(method, 0) > 0:
+			self.flood_waits[method] -= 1
+			self.flooded[method] += 1
+			raise FloodWait(value=self.flood_seconds)
+		if self.flood_rate > 0 and self.random.random() < self.flood_rate:
+			self.flooded[method] += 1
+			raise FloodWait(value=self.flood_seconds)
+
+	def _check_failure(self, method: str):
+		if self.failures.get(method) == self.calls[method]:
+			raise Exception(f'{method} call #{self.calls[method]} failed.')
+
+	# "upload" the file in 512KiB parts, like pyrogram does, reporting the progress
+	async def _upload(self, file: str|io.BytesIO, progress=None):
+		if isinstance(file, str):
+			size = os.path.getsize(file)
+		else:
+			size = file.getbuffer().nbytes
+		part_size = 512*1024
+		for current in range(0, size, part_size):
+			part = min(part_size, size-current)
+			if self.bandwidth is not None:
+				await asyncio.sleep(part/self.bandwidth)
+			self.sent_bytes += part
+			if progress is not None:
+				progress(current+part, size)
+
+	async def send_photo(self, chat_id: int|str, photo: str|io.BytesIO, caption: str = '', **kwargs):
+		await self._request('send_photo')
+		await self._upload(photo)
+		self._check_failure('send_photo')
+		return self.server.post(chat_id, caption)
+
+	async def send_audio(self, chat_id: int|str, audio: str|io.BytesIO, title: str = '', progress=None, **kwargs):
+		await self._request('send_audio')
+		await self._upload(audio, progress)
+		self._check_failure('send_audio')
+		return self.server.post(chat_id, title)
+
+	async def copy_message(self, chat_id: int|str, from_chat_id: int|str, message_id: int, **kwargs):
+		await self._request('copy_message')
+		self._check_failure('copy_message')
+		return self.server.post(chat_id, self.server.chats[from_chat_id][message_id])
+
+	async def edit_message_caption(self, chat_id: int|str, message_id: int, caption: str, **kwargs):
+		await self._request('edit_message_caption')
+		self._check_failure('edit_message_caption')
+		if message_id not in self.server.chats.get(chat_id, {}):
+			raise Exception(f'MESSAGE_ID_INVALID: {message_id}')
+		self.server.chats[chat_id][message_id] = caption
+		return self.server.message(chat_id, message_id)
+
+	# returns the amount of deleted messages, like pyrogram
+	async def delete_messages(self, chat_id: int|str, message_ids: int|list[int], **kwargs) -> int:
+		await self._request('delete_messages')
+		self._check_failure('delete_messages')
+		if isinstance(message_ids, int):
+			message_ids = [message_ids]
+		chat = self.server.chats.get(chat_id, {})
+		return sum(chat.pop(message_id, None) is not None for message_id in message_ids)
+
+for method in ('send_photo', 'send_audio', 'copy_message', 'edit_message_caption', 'delete_messages'):
+	async_to_sync(FakeClient, method)
@@ -0,0 +1,78 @@
+import mutagen.id3
+import os
+import random
+import time
+
+# synthetic library data shared by the test scripts
+
+# a release in the database form (see the README), like scan_release returns it
+# * title: track number -> title tag
+# * rng: randomizes the mtimes, lengths, formats and embedded artwork and adds random ReplayGain tags,
+#   otherwise every track is a 16/44.1 180s one without ReplayGain
+# * tags: extra tags of every track
+# * release_path: also write the tracks there, as track_size random bytes each
+def gen_release(
+		track_count: int = 12,
+		album: str = 'Album',
+		artist: str = 'Artist',
+		date: str = '2023',
+		title = lambda number: f'Track {number}',
+		rng: random.Random|None = None,
+		tags: dict|None = None,
+		images: dict|None = None,
+		files: dict|None = None,
+		release_path: str|None = None,
+		track_size: int = 0
+	) -> dict:
+	width = max(2, len(str(track_count)))
+	tracks = {}
+	for number in range(1, track_count+1):
+		filename = f'{number:0{width}} - Track {number}.flac'
+		if release_path is not None:
+			with open(os.path.join(release_path, filename), 'wb') as file:
+				file.write(os.urandom(track_size))
+		track = {
+			'mtime': 0.,
+			'depth': 16,
+			'rate': 44100,
+			'length': 180.,
+			'samples': 7938000,
+			'embedded_image': False,
+			'tags': {
+				'album': [album],
+				'albumartist': [artist],
+				'artist': [artist],
+				'date': [date],
+				'title': [title(number)],
+				'totaltracks': [str(track_count)],
+				'tracknumber': [str(number)],
+				**(tags or {})
+			}
+		}
+		if rng is not None:
+			track['mtime'] = time.time() - rng.uniform(0, 1e8)
+			track['depth'] = rng.choice((16, 24))
+			track['rate'] = rng.choice((44100, 48000, 96000))
+			track['length'] = rng.uniform(60, 600)
+			track['samples'] = int(track['rate']*track['length'])
+			track['embedded_image'] = rng.random() < 0.3
+			for gain_type in ('album', 'track'):
+				track['tags'][f'replaygain_{gain_type}_gain'] = [f'{rng.uniform(-12, 2):.2f} dB']
+				track['tags'][f'replaygain_{gain_type}_peak'] = [f'{rng.uniform(0.5, 1):.6f}']
+		# scan_release sorts the tags
+		track['tags'] = dict(sorted(track['tags'].items()))
+		tracks[filename] = track
+	return {
+		'tracks': tracks,
+		'images': images if images is not None else {},
+		'files': files if files is not None else {}
+	}
+
+# a second of silent MPEG-1 Layer III frames (128kbps, 44.1kHz) with the given ID3 frames
+def gen_mp3(file_path: str, frames: list):
+	with open(file_path, 'wb') as file:
+		file.write( (b'\xff\xfb\x90\x64' + bytes(413))*39 )
+	tags = mutagen.id3.ID3()
+	for frame in frames:
+		tags.add(frame)
+	tags.save(file_path)
@@ -0,0 +1,71 @@
+from despot.library import (Journal, analyze_gain, build_tag_index, load_db, save_db,
+		update_db, verify_stats)
+import mutagen.flac
+import subprocess
+from os import makedirs, path
+from sys import exit
+from tempfile import TemporaryDirectory
+
+# analyze the gain of a generated library (FLAC tracks without ReplayGain tags) with a journal,
+# then "crash" before saving the database and check that loading it brings back the results
+# and that the next update_db rebuilds the statistics and the tag index from them
+# ffmpeg is needed both for generating the library and for the analysis
+
+release_count = 2
+track_count = 2
+
+def gen_library(root: str):
+	for r in range(release_count):
+		release_path = path.join(root, 'Artist', f'Album {r+1}')
+		makedirs(release_path)
+		for t in range(track_count):
+			track_path = path.join(release_path, f'{t+1:02} - Track {t+1}.flac')
+			subprocess.run(
+					[ 'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i',
+						f'sine=frequency={220*(t+1)}:sample_rate=44100:duration=3',
+						'-ac', '2', '-sample_fmt', 's16', track_path ],
+					check=True
+			)
+			flac = mutagen.flac.FLAC(track_path)
+			flac.update({
+				'album': f'Album {r+1}',
+				'albumartist': 'Artist',
+				'artist': 'Artist',
+				'title': f'Track {t+1}',
+				'tracknumber': str(t+1)
+			})
+			flac.save()
+
+def gain_tags(db: dict) -> dict:
+	return dict(
+		(release_path, dict(
+			(track_name, ( dict((k, v) for k, v in track["tags"].items() if k.startswith("replaygain_")), track.get("computed_gain") ))
+			for track_name, track in release["tracks"].items()
+		))
+		for release_path, release in db["releases"].items()
+	)
+
+checks = {}
+with TemporaryDirectory() as root, TemporaryDirectory() as tmp:
+	gen_library(root)
+	db_path = path.join(tmp, 'db.zstd')
+	db = {"root": root, "releases": {}}
+	update_db(db)
+	save_db(db, db_path)
+
+	journal = Journal(db_path)
+	report = analyze_gain(db, journal=journal)
+	journal.close()
+	checks["analyzed"] = len(report["analyzed"]) == release_count
+	# the database is not saved, as if the process was killed right after the analysis
+	loaded = load_db(db_path)
+	checks["results replayed"] = gain_tags(loaded) == gain_tags(db) and len(gain_tags(loaded)) == release_count
+	checks["derived data invalidated"] = "statistics_state" not in loaded and "tag_index" not in loaded
+	update_db(loaded)
+	checks["statistics rebuilt"] = verify_stats(loaded)
+	checks["tag index rebuilt"] = loaded["tag_index"] == build_tag_index(loaded["releases"])
+
+for name, passed in checks.items():
+	print(f"{name}: {passed}")
+if not all(checks.values()):
+	exit(1)
@@ -9,7 +9,8 @@ db = {}
 db["root"] = argv[1] if len(argv) > 1 else path.join(path.dirname(path.realpath(__file__)),'library')
 
 t = time.time()
-release_list = gen_release_list(db["root"])
+db["directories"] = {}
+release_list = gen_release_list(db["root"], db["directories"])
 print(f"release_list: {time.time()-t}")
 t = time.time()
 
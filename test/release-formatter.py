@@ -0,0 +1,77 @@
+import os
+import random
+import sys
+import time
+from icu._icu_ import Transliterator
+from fixtures import gen_release
+# upload.py imports its neighbours directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'despot'))
+from library import get_tag_fom_first_track
+from upload import ReleaseFormatter, transliterate
+
+# compare the caption rendering during a release upload (a render after every track)
+# with the old format_release_string on synthetic 100-track releases with non-latin titles
+
+track_count = 100
+release_count = 10
+release_string = "{albumartist} - {album} ({date}) [{depth_rates}]\nTracks:{totaltracks}{latin_tracklist}"
+words = ('Песня', 'ночь', 'дорога', '夜明け', 'の', '歌', 'Λόγος', 'θάλασσα', 'Музыка', '風')
+
+# the way format_release_string used to work
+def old_format_release_string(release_string: str, release: dict, channel_type: str, track_separator: str = '. ') -> str:
+	link_field = 'link_'+channel_type
+	to_latin = Transliterator.createInstance("Any-Latin")
+	formatting_data = {
+		'album': get_tag_fom_first_track(release, 'album'),
+		'albumartist': get_tag_fom_first_track(release, 'albumartist'),
+		'date': get_tag_fom_first_track(release, 'date'),
+		'totaltracks': get_tag_fom_first_track(release, 'totaltracks'),
+		'depth_rates': set(f'{track["depth"]}/{int(track["rate"])/1000}' for track in release["tracks"].values() )
+	}
+	formatting_data['depth_rates'] = ', '.join(formatting_data['depth_rates'])
+	latin_tracklist = ""
+	for track in release["tracks"].values():
+		entry = track_separator.join([
+				track["tags"]["tracknumber"][0],
+				to_latin.transliterate(track["tags"]["title"][0])
+		])
+		if link_field in track.keys():
+			latin_tracklist += f'\n[{entry}]({track[link_field]})'
+		else:
+			latin_tracklist += f'\n{entry}'
+	return release_string.format(**formatting_data, latin_tracklist=latin_tracklist)
+
+# the same random titles for the same number
+def gen_titled_release(number: int) -> dict:
+	rng = random.Random(number)
+	return gen_release(track_count, f'Альбом {number}', 'Исполнитель',
+			title=lambda _: ' '.join(rng.choice(words) for _ in range(4)))
+
+# render the caption after every "uploaded" track, like upload_release does
+def upload(release: dict, render) -> list[str]:
+	captions = []
+	for number, track in enumerate(release['tracks'].values()):
+		track['link_opus'] = f'https://t.me/channel/{number+2}'
+		captions.append(render())
+	return captions
+
+old_time = 0.
+new_time = 0.
+equal = True
+for number in range(release_count):
+	release = gen_titled_release(number)
+	t = time.time()
+	old_captions = upload(release, lambda: old_format_release_string(release_string, release, 'opus'))
+	old_time += time.time()-t
+	release = gen_titled_release(number)
+	t = time.time()
+	formatter = ReleaseFormatter(release_string, release, 'opus')
+	new_captions = upload(release, formatter.render)
+	new_time += time.time()-t
+	equal = equal and old_captions == new_captions
+
+print(f"{release_count} releases x {track_count} tracks, a render after every track")
+print(f"old format_release_string: {old_time:.3f}s ({old_time/release_count*1000:.1f} ms per release)")
+print(f"ReleaseFormatter: {new_time:.3f}s ({new_time/release_count*1000:.1f} ms per release)")
+print(f"same captions: {equal}")
+print(f"transliteration cache: {transliterate.cache_info()}")
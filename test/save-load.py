@@ -0,0 +1,65 @@
+from despot.library import save_db, load_db, save_db_stream, load_db_stream, train_db_dictionary
+from fixtures import gen_release
+import gc
+import json
+import random
+import time
+from os import path
+from sys import argv
+from tempfile import TemporaryDirectory
+
+# compare time and peak RSS of the monolithic and streaming save/load functions
+# uses the given database or a synthetic one (linux only, reads /proc)
+
+def rss() -> int:
+	with open('/proc/self/status') as status:
+		for line in status:
+			if line.startswith('VmRSS:'):
+				return int(line.split()[1])*1024
+	return 0
+
+def peak_rss() -> int:
+	with open('/proc/self/status') as status:
+		for line in status:
+			if line.startswith('VmHWM:'):
+				return int(line.split()[1])*1024
+	return 0
+
+def reset_peak_rss():
+	with open('/proc/self/clear_refs', 'w') as clear_refs:
+		clear_refs.write('5')
+
+def measure(name: str, function):
+	gc.collect()
+	reset_peak_rss()
+	base = rss()
+	t = time.time()
+	result = function()
+	print(f"{name}: {time.time()-t:.2f}s, peak RSS +{(peak_rss()-base)/1024/1024:.1f} MiB")
+	return result
+
+def gen_db(track_count: int = 100000) -> dict:
+	rng = random.Random(0)
+	releases = {}
+	for r in range(track_count//10):
+		releases[f"/library/Artist {r//5}/Album {r}"] = gen_release(10, f"Album {r}", f"Artist {r//5}", rng=rng,
+				images={"cover.jpg": {"mtime": time.time()}})
+	return json.loads(json.dumps({"root": "/library", "releases": releases}))
+
+db = load_db(argv[1]) if len(argv) > 1 else gen_db()
+print(f"releases: {len(db['releases'])}")
+
+with TemporaryDirectory() as tmp:
+	zstd_path = path.join(tmp, 'db.zstd')
+	stream_path = path.join(tmp, 'db.jsonl.zst')
+	dict_path = path.join(tmp, 'db_dict.jsonl.zst')
+	measure("save_db", lambda: save_db(db, zstd_path))
+	measure("save_db_stream", lambda: save_db_stream(db, stream_path))
+	dictionary = measure("train_db_dictionary", lambda: train_db_dictionary(db))
+	measure("save_db_stream (dictionary)", lambda: save_db_stream(db, dict_path, dict_data=dictionary))
+	for file in (zstd_path, stream_path, dict_path):
+		print(f"{path.basename(file)}: {path.getsize(file)/1024/1024:.1f} MiB")
+	del db
+	measure("load_db", lambda: load_db(zstd_path))
+	measure("load_db_stream", lambda: load_db_stream(stream_path))
+	measure("load_db_stream (dictionary)", lambda: load_db_stream(dict_path, dictionary))
@@ -0,0 +1,43 @@
+from despot.library import save_db_sqlite, load_db_sqlite
+from fixtures import gen_release
+from os import path
+from sys import exit
+from tempfile import TemporaryDirectory
+
+# save and reload a synthetic database with the SQLite backend:
+# full and partial saves, removed releases and removed top-level keys
+# fails if any reloaded database differs from the saved one
+
+db = {
+	"root": "/library",
+	"statistics": {"total_length": 0.},
+	"statistics_state": {"critical_tags": [], "wanted_tags": [], "release_count": 3},
+	"foo": "bar",
+	"releases": dict( (f"/library/Artist/Album {r}", gen_release(4, f"Album {r}")) for r in range(3) )
+}
+
+checks = {}
+with TemporaryDirectory() as tmp:
+	db_path = path.join(tmp, 'db.sqlite')
+	save_db_sqlite(db, db_path)
+	checks["full save"] = load_db_sqlite(db_path) == db
+
+	db["releases"]["/library/Artist/Album 0"]["tracks"]["01 - Track 1.flac"]["mtime"] = 1.
+	save_db_sqlite(db, db_path, ["/library/Artist/Album 0"])
+	checks["partial save"] = load_db_sqlite(db_path) == db
+
+	del db["releases"]["/library/Artist/Album 2"]
+	save_db_sqlite(db, db_path)
+	checks["removed release"] = load_db_sqlite(db_path) == db
+
+	# remove_releases and analyze_gain drop statistics_state to force a statistics rebuild
+	db.pop("statistics_state")
+	db.pop("foo")
+	save_db_sqlite(db, db_path)
+	loaded = load_db_sqlite(db_path)
+	checks["removed keys"] = "statistics_state" not in loaded and "foo" not in loaded and loaded == db
+
+for name, passed in checks.items():
+	print(f"{name}: {passed}")
+if not all(checks.values()):
+	exit(1)
@@ -1,4 +1,4 @@
-from despot.library import update_db
+from despot.library import update_db, remove_releases
 import json
 import time
 
@@ -8,10 +8,15 @@ print(f"load: {time.time()-t}")
 t = time.time()
 
 t = time.time()
-deleted_releases, modified_releases, new_scans = update_db(db)
+deleted_releases, modified_releases = update_db(db)
 print(f"update_db: {time.time()-t}")
 t = time.time()
 
+# the deleted releases would be deleted from telegram first
+remove_releases(db, deleted_releases.keys())
+print(f"remove_releases: {time.time()-t}")
+t = time.time()
+
 db["update_time"] = t
 json.dump(
 		db,
@@ -22,4 +27,3 @@ print(f"dump: {time.time()-t}")
 
 print(f"Deleted: {deleted_releases}")
 print(f"Modified: {modified_releases}")
-print(f"New: {new_scans.keys()}")
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from tempfile import TemporaryDirectory
+import mutagen.flac
+from PIL import Image
+# upload.py imports its neighbours directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'despot'))
+from fake_client import FakeClient
+from library import gen_release_list, scan_release
+from scheduler import ClientScheduler
+from upload import RG_Clip, RG_Mode, delete_releases_from_telegram, upload_release
+
+assets_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'assets')
+
+# end-to-end upload benchmark against a generated library and a local fake client:
+# uploads every release to an orig and an opus channel, then deletes them all,
+# and reports tracks/sec, bytes/sec and the API calls per release
+# usage: upload-throughput.py [releases] [tracks per release] [track seconds]
+# the fake client settings below emulate a slow account with occasional flood waits
+# ffmpeg is needed both for generating the library and for the opus encoding
+
+release_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+track_count = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+track_length = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+client_settings = {
+	'latency': 0.05,
+	'bandwidth': 8*1024**2,
+	'flood_waits': { 'send_audio': 1 },
+	'flood_rate': 0.01,
+	'flood_seconds': 1,
+	'seed': 0
+}
+release_string = "{albumartist} - {album} ({date}) [{depth_rates}]\nTracks:{totaltracks}{latin_tracklist}"
+opus_settings = {
+	'bitrate': 96,
+	'embed_cover': False,
+	'replaygain': { 'mode': RG_Mode.REPLAYGAIN, 'clipping_policy': RG_Clip.NONE }
+}
+
+def gen_library(root: str):
+	for r in range(release_count):
+		release_path = os.path.join(root, 'Артист', f'Альбом {r+1}')
+		os.makedirs(release_path)
+		Image.linear_gradient('L').resize((1200, 1200)).convert('RGB').save(os.path.join(release_path, 'cover.jpg'))
+		for t in range(track_count):
+			track_path = os.path.join(release_path, f'{t+1:02} - Трек {t+1}.flac')
+			subprocess.run(
+					[ 'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i',
+						f'sine=frequency={220*(t+1)}:sample_rate=44100:duration={track_length}',
+						'-ac', '2', '-sample_fmt', 's16', track_path ],
+					check=True
+			)
+			flac = mutagen.flac.FLAC(track_path)
+			flac.update({
+				'album': f'Альбом {r+1}',
+				'albumartist': 'Артист',
+				'artist': 'Артист',
+				'date': '2023',
+				'title': f'Трек {t+1}',
+				'tracknumber': str(t+1),
+				'totaltracks': str(track_count),
+				'replaygain_track_gain': '-3.00 dB',
+				'replaygain_album_gain': '-3.00 dB',
+				'replaygain_track_peak': '0.5',
+				'replaygain_album_peak': '0.5'
+			})
+			flac.save()
+
+async def benchmark(releases: dict, channel_type: str, tmp: str):
+	fake = FakeClient(**client_settings)
+	client = ClientScheduler(fake, flush_interval=1.)
+	channel = channel_type
+	t = time.time()
+	for release_path, release in releases.items():
+		await upload_release(release, release_path, client, channel, tmp, assets_dir,
+				release_string, [], [], opus_settings if channel_type == 'opus' else None, lambda **d: None)
+	elapsed = time.time()-t
+	tracks = release_count*track_count
+	upload_calls = Counter(fake.calls)
+	print(f"{channel_type} upload: {elapsed:.2f}s, {tracks/elapsed:.2f} tracks/s, {fake.sent_bytes/elapsed/1024**2:.2f} MiB/s "
+			f"({fake.sent_bytes/1024**2:.1f} MiB), waited {client.waited:.2f}s")
+	print(f"\tcalls per release: { {method: calls/release_count for method, calls in upload_calls.items()} }")
+	print(f"\tflood waits: {dict(fake.flooded)}")
+	print(f"\tmessages in the channel: {len(fake.server.chats[channel])}/{release_count*(track_count+1)}, "
+			f"all links in captions: {all(caption.count('](') == track_count for id, caption in fake.server.chats[channel].items() if caption.startswith('Артист'))}")
+	t = time.time()
+	deleted = await delete_releases_from_telegram(releases, client, channel, channel_type)
+	print(f"{channel_type} deletion: {time.time()-t:.2f}s, deleted {deleted}, "
+			f"calls: {fake.calls['delete_messages']}, messages left: {len(fake.server.chats[channel])}")
+
+async def main():
+	with TemporaryDirectory() as root, TemporaryDirectory() as tmp:
+		t = time.time()
+		gen_library(root)
+		releases = dict( (release_path, scan_release(release_path)) for release_path in gen_release_list(root) )
+		size = sum(
+				os.path.getsize(os.path.join(release_path, filename))
+				for release_path, release in releases.items() for filename in release['tracks']
+		)
+		print(f"library: {release_count} releases x {track_count} tracks x {track_length}s, "
+				f"{size/1024**2:.1f} MiB, generated in {time.time()-t:.2f}s")
+		print(f"fake client: {client_settings}")
+		for channel_type in ('orig', 'opus'):
+			await benchmark(releases, channel_type, tmp)
+
+asyncio.run(main())